@@ -6,7 +6,7 @@ from djangae.db import transaction
 
 from google.appengine.ext.deferred import defer
 
-from fluent.models import MasterTranslation, Translation, ScanMarshall
+from fluent.models import MasterTranslation, MissingTranslation, StringUsage, Translation, ScanMarshall
 from fluent.scanner import begin_scan
 
 
@@ -34,5 +34,28 @@ class MasterTranslationAdmin(admin.ModelAdmin):
         ]
 
 
+class MissingTranslationAdmin(admin.ModelAdmin):
+    list_display = ("text", "hint", "language_code", "count", "last_seen")
+    list_filter = ("language_code",)
+    ordering = ("-count",)
+    readonly_fields = ("text", "hint", "language_code", "count", "first_seen", "last_seen")
+
+    def has_add_permission(self, request):
+        # These are only written by the translation cache
+        return False
+
+
+class StringUsageAdmin(admin.ModelAdmin):
+    list_display = ("text", "hint", "count", "last_seen")
+    ordering = ("-count",)
+    readonly_fields = ("text", "hint", "count", "first_seen", "last_seen")
+
+    def has_add_permission(self, request):
+        # These are only written by the translation cache
+        return False
+
+
 admin.site.register(MasterTranslation, MasterTranslationAdmin)
+admin.site.register(MissingTranslation, MissingTranslationAdmin)
+admin.site.register(StringUsage, StringUsageAdmin)
 admin.site.register(Translation)
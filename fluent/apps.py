@@ -1,12 +1,49 @@
 
 
+import threading
+
 from django.apps import AppConfig
+from django.conf import settings
 
 class FluentAppConfig(AppConfig):
     name = "fluent"
 
     def ready(self):
         from django.core.signals import request_finished, request_started
-        from fluent.trans import ensure_threads_join, invalidate_caches_if_necessary
+        from django.db.models.signals import post_delete
+        from fluent.models import Translation
+        from fluent.trans import (
+            ensure_threads_join,
+            flush_reports_if_necessary,
+            invalidate_caches_if_necessary,
+            invalidate_deleted_translation,
+            load_translation_snapshot,
+            prewarm_translations,
+            reset_fallback_budget,
+            start_invalidation_poller,
+        )
         request_finished.connect(ensure_threads_join, dispatch_uid="fluent.ensure_threads_join")
+        request_finished.connect(flush_reports_if_necessary, dispatch_uid="fluent.flush_reports_if_necessary")
         request_started.connect(invalidate_caches_if_necessary, dispatch_uid="fluent.invalidate_caches_if_necessary")
+        request_started.connect(reset_fallback_budget, dispatch_uid="fluent.reset_fallback_budget")
+        post_delete.connect(invalidate_deleted_translation, sender=Translation, dispatch_uid="fluent.invalidate_deleted_translation")
+
+        if getattr(settings, "FLUENT_POLL_FOR_INVALIDATIONS", False):
+            start_invalidation_poller()
+
+        snapshot_file = getattr(settings, "FLUENT_SNAPSHOT_FILE", None)
+        if snapshot_file:
+            load_translation_snapshot(snapshot_file, getattr(settings, "FLUENT_PREWARM_WORKERS", 4))
+
+        prewarm = getattr(settings, "FLUENT_PREWARM_LANGUAGES", False)
+        if prewarm:
+            language_codes = None if prewarm is True else prewarm
+            workers = getattr(settings, "FLUENT_PREWARM_WORKERS", 4)
+            if getattr(settings, "FLUENT_PREWARM_IN_BACKGROUND", False):
+                thread = threading.Thread(target=prewarm_translations, args=(language_codes, workers))
+                thread.daemon = True
+                thread.start()
+            else:
+                # Loading here means that the tables are in memory before a preloading
+                # server forks its workers
+                prewarm_translations(language_codes, workers)
@@ -0,0 +1,256 @@
+""" Compiled, memory-mapped translation catalogs.
+
+    A catalog holds every translation of one language in a single file, which worker processes
+    `mmap` so that the pages are shared between them rather than each process building its
+    own table. The layout (all integers little-endian) is:
+
+    - A header: magic, format version, number of entries, number of index buckets and the
+      length of the JSON metadata which follows it.
+    - The metadata: the language code, the versions of the language when the catalog was
+      compiled and the time from which later modifications need to be applied on top.
+    - The index: an open addressing hash table of (hash, record offset) buckets. A hash of
+      zero marks an empty bucket.
+    - The records: the master text and hint, followed by the plural forms in the order used
+      by TranslationForms. Strings are UTF-8 and prefixed with their length, a length of
+      0xFFFFFFFF marks a missing form.
+"""
+import datetime
+import json
+import mmap
+import os
+import struct
+from hashlib import md5
+
+from django.utils import timezone
+
+from djangae.db import transaction
+
+from fluent.models import Translation
+from fluent.trans import (
+    TranslationForms,
+    _build_table,
+    _cache_key,
+    _ensure_full_version,
+    _get_language_versions,
+)
+
+
+MAGIC = "FLCT"
+FORMAT_VERSION = 1
+
+_HEADER = struct.Struct("<4sHIII")
+_BUCKET = struct.Struct("<QI")
+_RECORD = struct.Struct("<IIB")
+_LENGTH = struct.Struct("<I")
+_MISSING_FORM = 0xFFFFFFFF
+
+_DATETIME_FORMAT = "%Y-%m-%dT%H:%M:%S.%f"
+
+
+def _encode(value):
+    return value.encode("utf-8") if isinstance(value, unicode) else value
+
+
+def _split_key(key):
+    return key if isinstance(key, tuple) else (key, "")
+
+
+def _hash(text, hint):
+    """ A 64 bit hash of the encoded text and hint, never zero as that marks empty buckets. """
+    return struct.unpack("<Q", md5(text + "\0" + hint).digest()[:8])[0] or 1
+
+
+def catalog_path(directory, language_code):
+    return os.path.join(directory, "{}.catalog".format(language_code))
+
+
+def write_catalog(path, language_code, table, versions, modified_since):
+    """ Write the entries of `table` (a mapping of cache keys to TranslationForms) to a
+        catalog at `path`. The file is replaced atomically so that processes which have the
+        old catalog mapped are unaffected.
+    """
+    metadata = json.dumps({
+        "language_code": language_code,
+        "versions": list(versions),
+        "modified_since": timezone.make_naive(modified_since, timezone.utc).strftime(_DATETIME_FORMAT)
+        if timezone.is_aware(modified_since) else modified_since.strftime(_DATETIME_FORMAT),
+    })
+
+    num_buckets = 1
+    while num_buckets < len(table) * 2:
+        num_buckets *= 2
+    buckets = [(0, 0)] * num_buckets
+
+    index_offset = _HEADER.size + len(metadata)
+    offset = index_offset + _BUCKET.size * num_buckets
+
+    records = []
+    for key, forms in table.iteritems():
+        text, hint = [_encode(x) for x in _split_key(key)]
+
+        record = [_RECORD.pack(len(text), len(hint), len(forms)), text, hint]
+        for form in forms:
+            if form is None:
+                record.append(_LENGTH.pack(_MISSING_FORM))
+            else:
+                form = _encode(form)
+                record.extend([_LENGTH.pack(len(form)), form])
+        record = "".join(record)
+
+        bucket = key_hash = _hash(text, hint)
+        while True:
+            bucket %= num_buckets
+            if not buckets[bucket][0]:
+                buckets[bucket] = (key_hash, offset)
+                break
+            bucket += 1
+
+        records.append(record)
+        offset += len(record)
+
+    temp_path = "{}.{}.tmp".format(path, os.getpid())
+    with open(temp_path, "wb") as f:
+        f.write(_HEADER.pack(MAGIC, FORMAT_VERSION, len(table), num_buckets, len(metadata)))
+        f.write(metadata)
+        for bucket in buckets:
+            f.write(_BUCKET.pack(*bucket))
+        for record in records:
+            f.write(record)
+    os.rename(temp_path, path)
+
+
+@transaction.non_atomic
+def compile_catalog(directory, language_code):
+    """ Compile the catalog of `language_code` from the Translation table into `directory`. """
+    # The catalog is only used while the full version is unchanged, so it needs one
+    _ensure_full_version(language_code)
+    versions = _get_language_versions([language_code])[language_code]
+    modified_since = timezone.now()
+
+    table = _build_table(Translation.objects.filter(language_code=language_code))
+
+    path = catalog_path(directory, language_code)
+    write_catalog(path, language_code, table, versions, modified_since)
+    return path
+
+
+class MappedCatalog(object):
+    """ Read-only view of a compiled catalog file. Lookups probe the mapped index in place,
+        only the strings of a matching entry are decoded.
+    """
+
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            self._data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, format_version, self._num_entries, self._num_buckets, metadata_length = _HEADER.unpack_from(self._data)
+        if magic != MAGIC or format_version != FORMAT_VERSION:
+            raise ValueError("{} is not a compatible translation catalog".format(path))
+
+        metadata = json.loads(self._data[_HEADER.size:_HEADER.size + metadata_length])
+        self.language_code = metadata["language_code"]
+        self.versions = tuple(metadata["versions"])
+        self.modified_since = timezone.make_aware(
+            datetime.datetime.strptime(metadata["modified_since"], _DATETIME_FORMAT), timezone.utc
+        )
+
+        self._index_offset = _HEADER.size + metadata_length
+
+    def __len__(self):
+        return self._num_entries
+
+    def _read_string(self, offset):
+        length = _LENGTH.unpack_from(self._data, offset)[0]
+        offset += _LENGTH.size
+        if length == _MISSING_FORM:
+            return None, offset
+        return self._data[offset:offset + length].decode("utf-8"), offset + length
+
+    def _read_forms(self, offset, num_forms):
+        forms = []
+        for i in xrange(num_forms):
+            form, offset = self._read_string(offset)
+            forms.append(form)
+        return TranslationForms(forms)
+
+    def get(self, key, default=None):
+        text, hint = [_encode(x) for x in _split_key(key)]
+        key_hash = _hash(text, hint)
+
+        bucket = key_hash
+        for i in xrange(self._num_buckets):
+            bucket_hash, offset = _BUCKET.unpack_from(
+                self._data, self._index_offset + (bucket % self._num_buckets) * _BUCKET.size
+            )
+            if not bucket_hash:
+                return default
+
+            if bucket_hash == key_hash:
+                text_length, hint_length, num_forms = _RECORD.unpack_from(self._data, offset)
+                offset += _RECORD.size
+                if (
+                    self._data[offset:offset + text_length] == text and
+                    self._data[offset + text_length:offset + text_length + hint_length] == hint
+                ):
+                    return self._read_forms(offset + text_length + hint_length, num_forms)
+            bucket += 1
+        return default
+
+    def __getitem__(self, key):
+        forms = self.get(key)
+        if forms is None:
+            raise KeyError(key)
+        return forms
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def iteritems(self):
+        for i in xrange(self._num_buckets):
+            bucket_hash, offset = _BUCKET.unpack_from(self._data, self._index_offset + i * _BUCKET.size)
+            if not bucket_hash:
+                continue
+
+            text_length, hint_length, num_forms = _RECORD.unpack_from(self._data, offset)
+            offset += _RECORD.size
+            text = self._data[offset:offset + text_length].decode("utf-8")
+            hint = self._data[offset + text_length:offset + text_length + hint_length].decode("utf-8")
+            yield _cache_key(text, hint), self._read_forms(offset + text_length + hint_length, num_forms)
+
+
+class LayeredCatalog(object):
+    """ A MappedCatalog with an in-memory overlay of the translations which have changed
+        since it was compiled. Like other tables it's never modified once published,
+        `patched` returns a new one.
+    """
+
+    def __init__(self, catalog, overlay=None):
+        self.catalog = catalog
+        self.overlay = overlay or {}
+
+    def patched(self, entries):
+        overlay = dict(self.overlay)
+        overlay.update(entries)
+        return LayeredCatalog(self.catalog, overlay)
+
+    def get(self, key, default=None):
+        forms = self.overlay.get(key)
+        if forms is None:
+            forms = self.catalog.get(key)
+        return default if forms is None else forms
+
+    def __getitem__(self, key):
+        forms = self.get(key)
+        if forms is None:
+            raise KeyError(key)
+        return forms
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def iteritems(self):
+        for key, forms in self.catalog.iteritems():
+            if key not in self.overlay:
+                yield key, forms
+        for item in self.overlay.iteritems():
+            yield item
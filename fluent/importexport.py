@@ -13,6 +13,7 @@ from collections import OrderedDict
 from .models import MasterTranslation, Translation
 from . import cldr
 from .cldr.rules import get_plural_index, get_rules_for_language
+from .trans import invalidate_language
 
 
 def export_translations_as_arb(masters, language_code=settings.LANGUAGE_CODE):
@@ -105,10 +106,14 @@ def import_translations_from_arb(file_in, language_code):
                 errors.append((e.message, master.text, data[str(pk)]))
                 continue
 
-            trans_errors = master.create_or_update_translation(language_code, singular_text=None, plural_texts=plurals, validate=True)
+            trans_errors = master.create_or_update_translation(
+                language_code, singular_text=None, plural_texts=plurals, validate=True, invalidate=False
+            )
             if trans_errors:
                 errors.extend(trans_errors)
                 continue
+
+    invalidate_language(language_code)
     return errors
 
 
@@ -161,8 +166,11 @@ def import_translations_from_csv(file_contents, language_code):
             mt.create_or_update_translation(
                 language_code,
                 singular_text,
-                plural_texts
+                plural_texts,
+                invalidate=False
             )
+
+    invalidate_language(language_code)
     return errors
 
 
@@ -206,11 +214,14 @@ def import_translations_from_po(file_contents, language_code, from_language):
         else:
             plural_texts, singular_text = None, entry.msgstr
 
-        trans_errors = master.create_or_update_translation(language_code, singular_text=singular_text, plural_texts=plural_texts, validate=True)
+        trans_errors = master.create_or_update_translation(
+            language_code, singular_text=singular_text, plural_texts=plural_texts, validate=True, invalidate=False
+        )
         if trans_errors:
             errors.extend(trans_errors)
             continue
 
+    invalidate_language(language_code)
     return errors
 
 
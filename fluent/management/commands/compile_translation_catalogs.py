@@ -0,0 +1,33 @@
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from fluent.catalog import compile_catalog
+
+
+class Command(BaseCommand):
+    help = "Compile the translations of each language into a catalog file which can be memory-mapped"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--language", action="append", dest="languages",
+            help="Language code to compile, can be repeated. Defaults to every language in LANGUAGES."
+        )
+        parser.add_argument(
+            "--output-dir", dest="output_dir", default=getattr(settings, "FLUENT_CATALOG_DIR", None),
+            help="Directory to write the catalogs to. Defaults to FLUENT_CATALOG_DIR."
+        )
+
+    def handle(self, *args, **options):
+        output_dir = options["output_dir"]
+        if not output_dir:
+            raise CommandError("Pass --output-dir or set FLUENT_CATALOG_DIR")
+
+        if not os.path.isdir(output_dir):
+            os.makedirs(output_dir)
+
+        language_codes = options["languages"] or [code for code, name in settings.LANGUAGES]
+        for language_code in language_codes:
+            path = compile_catalog(output_dir, language_code)
+            self.stdout.write("Compiled {}".format(path))
@@ -0,0 +1,26 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from fluent.trans import write_translation_snapshot
+
+
+class Command(BaseCommand):
+    help = "Write the translations of each language to a snapshot file which is loaded on startup"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "path", nargs="?", default=getattr(settings, "FLUENT_SNAPSHOT_FILE", None),
+            help="File to write the snapshot to. Defaults to FLUENT_SNAPSHOT_FILE."
+        )
+        parser.add_argument(
+            "--language", action="append", dest="languages",
+            help="Language code to include, can be repeated. Defaults to every language in LANGUAGES."
+        )
+
+    def handle(self, *args, **options):
+        path = options["path"]
+        if not path:
+            raise CommandError("Pass a path or set FLUENT_SNAPSHOT_FILE")
+
+        write_translation_snapshot(path, options["languages"])
+        self.stdout.write("Wrote {}".format(path))
@@ -31,6 +31,58 @@ class ScanMarshall(models.Model):
         app_label = "fluent"
 
 
+class MissingTranslation(models.Model):
+    """ A string which has been looked up in a language it has no translation for, and how
+        many times. Written in batches by the translation cache, see fluent.trans.
+    """
+    id = models.CharField(max_length=64, primary_key=True)
+
+    text = models.TextField(editable=False)
+    hint = models.CharField(max_length=500, blank=True, editable=False)
+    language_code = models.CharField(max_length=8, editable=False)
+
+    count = models.PositiveIntegerField(default=0, editable=False)
+    first_seen = models.DateTimeField(editable=False)
+    last_seen = models.DateTimeField(editable=False)
+    # The flush whose counts were last added, so that they aren't added again by a retry
+    last_flush = models.CharField(max_length=32, blank=True, editable=False)
+
+    class Meta:
+        app_label = "fluent"
+
+    def __unicode__(self):
+        return u"{} missing from {}".format(self.text, self.language_code)
+
+    @staticmethod
+    def generate_key(text, hint, language_code):
+        # The same scheme as MasterTranslation, with the language the string is missing from
+        return MasterTranslation.generate_key(text, hint, language_code)
+
+
+class StringUsage(models.Model):
+    """ An estimate of how many times a string has been translated, from a sample of the
+        lookups. Keyed by the same hash of the text and hint as
+        Translation.master_text_hint_hash. Written in batches by the translation cache, see
+        fluent.trans.
+    """
+    id = models.CharField(max_length=64, primary_key=True)
+
+    text = models.TextField(editable=False)
+    hint = models.CharField(max_length=500, blank=True, editable=False)
+
+    count = models.PositiveIntegerField(default=0, editable=False)
+    first_seen = models.DateTimeField(editable=False)
+    last_seen = models.DateTimeField(editable=False)
+    # The flush whose counts were last added, so that they aren't added again by a retry
+    last_flush = models.CharField(max_length=32, blank=True, editable=False)
+
+    class Meta:
+        app_label = "fluent"
+
+    def __unicode__(self):
+        return u"Usage of {}".format(self.text)
+
+
 class Translation(models.Model):
     master_translation = models.ForeignKey("fluent.MasterTranslation", editable=False, related_name="+")
     language_code = models.CharField(max_length=8, blank=False)
@@ -40,9 +92,18 @@ class Translation(models.Model):
     denorm_master_text = models.TextField(editable=False)
     denorm_master_hint = models.CharField(max_length=500, editable=False)
     denorm_master_language = models.CharField(max_length=8, editable=False)
+    # Allows the translation cache to load a language one group at a time
+    denorm_master_groups = SetField(models.CharField(max_length=64), editable=False, blank=True)
+
+    # False for the translation into the master's own language while it matches the master
+    # text, so the translation cache can skip those
+    differs_from_master = models.BooleanField(default=True, editable=False)
 
     master_text_hint_hash = models.CharField(max_length=64)
 
+    # Allows the translation cache to only reload what changed since it last loaded
+    last_modified = models.DateTimeField(auto_now=True, null=True)
+
     class Meta:
         app_label = "fluent"
 
@@ -93,6 +154,11 @@ class Translation(models.Model):
         self.denorm_master_text = self.master_translation.text
         self.denorm_master_hint = self.master_translation.hint
         self.denorm_master_language = self.master_translation.language_code
+        self.denorm_master_groups = set(self.master_translation.used_by_groups_in_code_or_templates or ())
+        self.differs_from_master = (
+            self.language_code != self.denorm_master_language or
+            self.plural_texts != self.master_translation.source_plural_texts()
+        )
 
         # For querying (you can't query for text on the datastore)
         self.master_text_hint_hash = Translation.generate_hash(
@@ -145,6 +211,15 @@ class MasterTranslation(models.Model):
         """
         return str("{}".format(self.id))
 
+    def source_plural_texts(self):
+        """ The plural texts of the translation into the master's own language, as created
+            along with it.
+        """
+        plurals = {get_plural_index(self.language_code, 1): self.text}
+        if self.is_plural:
+            plurals[get_plural_index(self.language_code, 2)] = self.plural_text
+        return plurals
+
     def get_display(self):
         from fluent.trans import _get_trans
         result = _get_trans(self.text, self.hint)
@@ -222,12 +297,7 @@ class MasterTranslation(models.Model):
         if self._state.adding:
             with transaction.atomic(xg=True):
 
-                singular_form = get_plural_index(self.language_code, 1)
-                plural_form = get_plural_index(self.language_code, 2)
-
-                plurals = {singular_form: self.text}
-                if self.is_plural:
-                    plurals[plural_form] = self.plural_text
+                plurals = self.source_plural_texts()
 
                 # if len(LANGUAGE_LOOKUPS[self.language_code].plurals_needed) > len(plurals):
                 # FIXME: We can detect that we're dealing with a language that needs more plurals
@@ -250,7 +320,11 @@ class MasterTranslation(models.Model):
             self.translated_into_languages = set(self.translations_by_language_code.keys())
             return super(MasterTranslation, self).save(*args, **kwargs)
 
-    def create_or_update_translation(self, language_code, singular_text=None, plural_texts=None, validate=False):
+    def create_or_update_translation(self, language_code, singular_text=None, plural_texts=None, validate=False,
+                                     invalidate=True):
+        """ Create or update the translation of this into `language_code`. Unless `invalidate`
+            is False, the translation caches are updated for just this translation.
+        """
 
         if language_code not in dict(settings.LANGUAGES).keys():
             return ["'{}' is not included as a language in your settings file".format(language_code)]
@@ -294,5 +368,9 @@ class MasterTranslation(models.Model):
                 self.translations.add(trans)
                 self.save()
 
+        if invalidate:
+            from fluent.trans import invalidate_translation
+            invalidate_translation(trans)
+
     class Meta:
         app_label = "fluent"
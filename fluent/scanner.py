@@ -13,7 +13,7 @@ from django.utils.translation import trim_whitespace
 
 from djangae.db import transaction
 
-from fluent.models import MasterTranslation, ScanMarshall
+from fluent.models import MasterTranslation, ScanMarshall, Translation
 
 from google.appengine.ext.deferred import defer
 
@@ -21,6 +21,9 @@ logger = logging.getLogger(__file__)
 
 DEFAULT_TRANSLATION_GROUP = "website"
 
+# The number of strings whose translations are synced with their groups per task
+_GROUP_SYNC_BATCH_SIZE = 100
+
 
 def parse_file(content, extension):
     """
@@ -216,6 +219,37 @@ def parse_file(content, extension):
         return results
 
 
+def _sync_translation_groups(master_translation):
+    """ Update the groups denormalized onto the translations of `master_translation`, saving
+        only the translations whose groups have changed.
+    """
+    groups = set(master_translation.used_by_groups_in_code_or_templates or ())
+    for translation in Translation.objects.filter(master_translation=master_translation):
+        if set(translation.denorm_master_groups or ()) != groups:
+            translation.master_translation = master_translation
+            translation.save()
+
+
+def _sync_scanned_translation_groups(scan_id, last_key=None):
+    """ Once a scan has finished, update the groups denormalized onto the translations of the
+        strings it found. This isn't done as the strings are found because the groups of a
+        string are only complete at the end of the scan. Syncs a batch of strings and defers
+        the rest.
+    """
+    queryset = MasterTranslation.objects.filter(
+        last_updated_by_scan_uuid=unicode(scan_id)
+    ).order_by("pk")
+    if last_key:
+        queryset = queryset.filter(pk__gt=last_key)
+
+    master_translations = list(queryset[:_GROUP_SYNC_BATCH_SIZE])
+    for master_translation in master_translations:
+        _sync_translation_groups(master_translation)
+
+    if len(master_translations) == _GROUP_SYNC_BATCH_SIZE:
+        defer(_sync_scanned_translation_groups, scan_id, master_translations[-1].pk)
+
+
 def _scan_list(marshall, scan_id, filenames):
     """ Given a list of filenames (file paths), of templates and/or python files, scan them for
         translatable strings and create corresponding MasterTranslation objects.
@@ -268,6 +302,10 @@ def _scan_list(marshall, scan_id, filenames):
                 marshall.refresh_from_db()
                 marshall.files_left_to_process -= len(filenames)
                 marshall.save()
+
+                if marshall.files_left_to_process == 0:
+                    # This was the last of the scan's tasks
+                    defer(_sync_scanned_translation_groups, scan_id, _transactional=True)
             return
         except TransactionFailedError:
             msg = "Transaction failed trying to decrement 'files_left_to_process' on ScanMarshall, "
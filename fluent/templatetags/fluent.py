@@ -6,6 +6,8 @@ from django.utils.translation import trim_whitespace
 from django.template.defaultfilters import force_escape, safe as safe_filter
 from django.utils.html import conditional_escape
 
+from fluent.trans import translation_group
+
 register = template.Library()
 
 
@@ -28,13 +30,34 @@ class EscapedTranslateNode(TranslateNode):
         return conditional_escape(content)
 
 
+class TranslationGroupNode(template.Node):
+    """ Renders `node` with its strings looked up in the partition of `group`. """
+
+    def __init__(self, node, group):
+        self.node = node
+        self.group = group
+        self.nodelist = template.NodeList([node])
+
+    def render(self, context):
+        with translation_group(self.group):
+            return self.node.render(context)
+
+
+def _strip_quotes(value):
+    if value[0] == value[-1] and value[0] in ("'", '"'):
+        return value[1:-1]
+    return value
+
+
 @register.tag("trans")
 def trans_override(parser, token):
     """
         Wraps around Django's trans tag, but allows for 'group "Thing"' to be
-        specified (group is only used for exporting) not for translation.
+        specified. The group is used for exporting, and for loading translations by group
+        if FLUENT_GROUP_PARTITIONS is set.
     """
     contents = token.split_contents()
+    group = None
 
     escape = True
     if "noescape" in contents:
@@ -55,7 +78,7 @@ def trans_override(parser, token):
     if escape:
         # If the 'noescape' option has NOT been passed, then we treat both the default text and the
         # translated text as not HTML safe.
-        return EscapedTranslateNode(
+        result = EscapedTranslateNode(
             result.filter_expression,
             result.noop,
             result.asvar,
@@ -68,7 +91,10 @@ def trans_override(parser, token):
         # result has come from a translation then Django will not treat it as safe, so we need to
         # add the |safe filter to tell Django not to escape it.
         result.filter_expression.filters.append((safe_filter, []))
-        return result
+
+    if group is not None:
+        return TranslationGroupNode(result, _strip_quotes(group))
+    return result
 
 
 def _trim_text(tokens):
@@ -88,11 +114,12 @@ def _escape_text(tokens):
 @register.tag("blocktrans")
 def blocktrans_override(parser, token):
     """
-        Wraps around Django's trans tag, but allows for 'group "Thing"' to be
-        specified (group is only used for exporting) not for translation.
+        Wraps around Django's blocktrans tag, but allows for 'group "Thing"' to be
+        specified, as for the trans tag.
     """
     contents = token.split_contents()
     trimmed = ("trimmed" in contents)
+    group = None
 
     escape = True
     if "noescape" in contents:
@@ -119,4 +146,6 @@ def blocktrans_override(parser, token):
         if node.plural:
             _escape_text(node.plural)
 
+    if group is not None:
+        return TranslationGroupNode(node, _strip_quotes(group))
     return node
@@ -0,0 +1,86 @@
+import shutil
+import tempfile
+
+from django.core.cache import cache
+from django.test import override_settings
+from django.utils import timezone
+from djangae.test import TestCase
+
+from fluent.catalog import LayeredCatalog, MappedCatalog, compile_catalog, write_catalog
+from fluent.models import MasterTranslation, Translation
+from fluent.trans import (
+    TranslationCache,
+    TranslationForms,
+    invalidate_language,
+    _get_language_versions,
+)
+
+
+class CatalogTests(TestCase):
+
+    def setUp(self):
+        # Catalogs record the language versions, which mustn't be left over from other tests
+        cache.clear()
+        self.catalog_dir = tempfile.mkdtemp()
+
+        self.mt = MasterTranslation.objects.create(text="Hello World!", language_code="en")
+        self.mt.create_or_update_translation("de", u"Hallo Welt!")
+
+        self.hinted_mt = MasterTranslation.objects.create(text="May", hint="Month", language_code="en")
+        self.hinted_mt.create_or_update_translation("de", u"Mai")
+
+        invalidate_language("de")
+
+    def tearDown(self):
+        shutil.rmtree(self.catalog_dir)
+
+    def test_catalog_round_trip(self):
+        table = {
+            u"Hello": TranslationForms([None, u"Hallo"]),
+            (u"May", u"Month"): TranslationForms([None, u"Mai"]),
+            u"{} apples": TranslationForms([None, u"{} Apfel", None, None, None, u"{} \xc4pfel"]),
+        }
+        path = self.catalog_dir + "/de.catalog"
+        write_catalog(path, "de", table, (1, 2), timezone.now())
+
+        catalog = MappedCatalog(path)
+        self.assertEqual(3, len(catalog))
+        self.assertEqual((1, 2), catalog.versions)
+        self.assertEqual(u"Hallo", catalog["Hello"]["o"])
+        self.assertEqual(u"Mai", catalog[("May", "Month")]["o"])
+        self.assertEqual(u"{} \xc4pfel", catalog[u"{} apples"]["h"])
+        self.assertIsNone(catalog.get("May"))
+        self.assertFalse("Goodbye" in catalog)
+        self.assertEqual(table, dict(catalog.iteritems()))
+
+    def test_languages_load_from_the_catalog(self):
+        compile_catalog(self.catalog_dir, "de")
+        self.assertIsNotNone(MappedCatalog(self.catalog_dir + "/de.catalog").versions[1])
+
+        # Edits after the catalog was compiled are applied on top of it
+        self.mt.create_or_update_translation("de", u"Hallo Erde!")
+
+        translation_cache = TranslationCache()
+        with override_settings(FLUENT_CATALOG_DIR=self.catalog_dir):
+            translation_cache.refetch_language("de")
+
+        table = translation_cache._translations["de"]
+        self.assertIsInstance(table, LayeredCatalog)
+        self.assertEqual(u"Hallo Erde!", table["Hello World!"]["o"])
+        self.assertEqual(u"Mai", table[("May", "Month")]["o"])
+
+    def test_catalog_ignored_after_full_invalidation(self):
+        compile_catalog(self.catalog_dir, "de")
+        Translation.objects.get(pk=self.hinted_mt.translations_by_language_code["de"]).delete()
+        self.assertNotEqual(
+            MappedCatalog(self.catalog_dir + "/de.catalog").versions,
+            _get_language_versions(["de"])["de"]
+        )
+
+        translation_cache = TranslationCache()
+        with override_settings(FLUENT_CATALOG_DIR=self.catalog_dir):
+            translation_cache.refetch_language("de")
+
+        table = translation_cache._translations["de"]
+        self.assertIsInstance(table, dict)
+        self.assertNotIn(("May", "Month"), table)
@@ -15,6 +15,7 @@ from fluent.fields import (
 )
 from fluent.models import MasterTranslation
 from fluent.patches import monkey_patch
+from fluent.trans import TranslationForms
 
 
 class TranslatedModel(models.Model):
@@ -179,10 +180,10 @@ class TranslatableContentTestCase(TestCase):
     def test_str_with_active_language(self):
         """ If there's a currently-active language, str should return the translated text. """
 
-        def mock_get_translation(text, hint, language_code):
+        def mock_get_translation(text, hint, language_code, group=None):
             if language_code == "de":
-                return {"singular": "translated", "o": "translated"}
-            return {"singular": self.text}
+                return TranslationForms.from_plural_texts({"o": "translated"})
+            return None
 
         translation.activate("de")
         with sleuth.switch(
@@ -205,10 +206,10 @@ class TranslatableContentTestCase(TestCase):
     def test_unicode_with_active_language(self):
         """ If there's a currently-active language, unicode should return the translated text. """
 
-        def mock_get_translation(text, hint, language_code):
+        def mock_get_translation(text, hint, language_code, group=None):
             if language_code == "de":
-                return {"singular": "translated", "o": "translated"}
-            return {"singular": self.text}
+                return TranslationForms.from_plural_texts({"o": "translated"})
+            return None
 
         translation.activate("de")
         with sleuth.switch(
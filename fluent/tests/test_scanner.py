@@ -3,10 +3,11 @@ from mock import patch, mock_open
 
 from djangae.contrib import sleuth
 from djangae.test import TestCase
+from django.conf import settings
 from django.template import Template, Context
 
 from fluent.scanner import _scan_list, parse_file, DEFAULT_TRANSLATION_GROUP
-from fluent.models import MasterTranslation, ScanMarshall
+from fluent.models import MasterTranslation, ScanMarshall, Translation
 from fluent.trans import TRANSLATION_CACHE
 
 
@@ -384,3 +385,30 @@ class ScanListTest(TestCase):
                         _scan_list(marshall, uuid.uuid4(), ['some_fake_name.html'])
 
         self.assertEquals(MasterTranslation.objects.get().used_by_groups_in_code_or_templates, {"public", "website"})
+
+    def _scan(self, marshall, scan_id, results):
+        with patch('__builtin__.open', mock_open()):
+            with sleuth.fake('os.path.exists', return_value=True):
+                with sleuth.fake('os.path.splitext', return_value=["some_fake_name", "html"]):
+                    with sleuth.fake('fluent.scanner.parse_file', results):
+                        _scan_list(marshall, scan_id, ['some_fake_name.html'])
+
+    def test_translation_groups_synced_when_scan_finishes(self):
+        mt = MasterTranslation.objects.create(text="Monday", language_code=settings.LANGUAGE_CODE)
+        mt.used_by_groups_in_code_or_templates = {"public", "website"}
+        mt.save()
+        mt.create_or_update_translation("de", u"Montag")
+        translation = Translation.objects.get(pk=mt.translations_by_language_code["de"])
+        translation.save()
+        last_modified = Translation.objects.get(pk=translation.pk).last_modified
+
+        # The groups are the same at the end of the scan, so the translation isn't re-saved
+        marshall = ScanMarshall.objects.create(files_left_to_process=1)
+        self._scan(marshall, uuid.uuid4(), [("Monday", "", "", "public"), ("Monday", "", "", "website")])
+        self.process_task_queues()
+        self.assertEqual(Translation.objects.get(pk=translation.pk).last_modified, last_modified)
+
+        marshall = ScanMarshall.objects.create(files_left_to_process=1)
+        self._scan(marshall, uuid.uuid4(), [("Monday", "", "", "public")])
+        self.process_task_queues()
+        self.assertEqual(Translation.objects.get(pk=translation.pk).denorm_master_groups, {"public"})
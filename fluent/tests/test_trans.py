@@ -1,21 +1,52 @@
-import datetime
+import os
+import shutil
+import tempfile
+import threading
+import time
 
 from djangae.contrib import sleuth
 
 from django.core.cache import cache
+from django.test import override_settings
 from django.utils import translation
 from djangae.test import TestCase
 
 from fluent.trans import (
     gettext,
+    gettext_many,
+    ungettext,
+    TranslationCache,
+    TranslationForms,
+    fallback_breaker_stats,
+    flush_missing_translations,
+    flush_string_usage,
+    hot_strings,
     invalidate_language,
+    load_translation_snapshot,
+    loader_stats,
+    prewarm_translations,
     translations_loading,
-    _language_invalidation_key,
+    ugettext_lazy,
+    write_translation_snapshot,
+    _add_counts,
+    _bump_language_version,
+    _get_language_versions,
+    _get_resolver,
+    _LoaderPool,
+    _lookup_settings,
+    _missing_translations,
+    _sample_usage,
+    _language_lease_key,
+    _language_snapshot_key,
+    _language_full_version_key,
+    check_for_invalidations,
     invalidate_caches_if_necessary,
+    reset_fallback_budget,
     TRANSLATION_CACHE,
 )
 
-from fluent.models import MasterTranslation
+from fluent.fields import TranslatableContent
+from fluent.models import MasterTranslation, MissingTranslation, StringUsage, Translation
 
 
 class TranslationTests(TestCase):
@@ -86,9 +117,8 @@ class TranslationTests(TestCase):
         while translations_loading():
             pass
 
-        # Set the invalidation key
-        key = _language_invalidation_key("de")
-        cache.set(key, datetime.datetime.utcnow())
+        # Bump the version, as another instance would when invalidating
+        _bump_language_version("de")
 
         # This shouldn't make a query, the invalidation hasn't applied yet
         with sleuth.watch("google.appengine.api.datastore.Query.Run") as query:
@@ -96,11 +126,791 @@ class TranslationTests(TestCase):
             self.assertEqual(trans, "Auf Wiedersehen Welt!")
             self.assertFalse(query.called)
 
-        # Run the finished signal
-        invalidate_caches_if_necessary(None)
+        # Run the check which the started signal does periodically
+        check_for_invalidations()
 
         # This should now cause a query
         with sleuth.watch("google.appengine.api.datastore.Query.Run") as query:
             trans = gettext("Goodbye World!")
             self.assertEqual(trans, "Auf Wiedersehen Welt!")
             self.assertTrue(query.called)
+
+    def test_lookups_do_not_take_the_write_lock(self):
+        translation.activate("de")
+        gettext("Hello World!")
+
+        # Wait for any background threads to finish
+        while translations_loading():
+            pass
+
+        class ExplodingLock(object):
+            def __enter__(self):
+                raise AssertionError("Lookups shouldn't need the write lock")
+
+            def __exit__(self, *args):
+                pass
+
+        original_lock = TRANSLATION_CACHE._write_lock
+        TRANSLATION_CACHE._lock = ExplodingLock()
+        try:
+            self.assertEqual(gettext("Goodbye World!"), "Auf Wiedersehen Welt!")
+        finally:
+            TRANSLATION_CACHE._lock = original_lock
+
+    def test_lookup_settings_are_remembered(self):
+        translation.activate("de")
+        gettext("Hello World!")
+        self.assertEqual(_lookup_settings["FLUENT_GROUP_PARTITIONS"], False)
+
+        # Changing a setting is picked up
+        with override_settings(FLUENT_PARTIAL_LANGUAGES={"de": 10}):
+            self.assertFalse("FLUENT_PARTIAL_LANGUAGES" in _lookup_settings)
+            TRANSLATION_CACHE.get_translation("Hello World!", "", "de")
+            self.assertTrue("de" in TRANSLATION_CACHE._partial_tables)
+        self.assertFalse("FLUENT_PARTIAL_LANGUAGES" in _lookup_settings)
+
+        while translations_loading():
+            pass
+
+    def test_write_lock_replaced_after_fork(self):
+        other_instance = TranslationCache()
+        held_lock = other_instance._write_lock
+        held_lock.acquire()
+
+        # Pretend that we were forked while a loader thread held the lock
+        other_instance._pid = -1
+        other_instance.invalidate("de", globally=False)
+        self.assertIsNot(other_instance._write_lock, held_lock)
+
+    @override_settings(FLUENT_SERVE_STALE_TRANSLATIONS=True)
+    def test_stale_translations_served_while_reloading(self):
+        translation.activate("de")
+        gettext("Hello World!")
+
+        # Wait for any background threads to finish
+        while translations_loading():
+            pass
+
+        # Edit without updating the cache, as if it happened on another instance
+        self.mt2.create_or_update_translation("de", u"Tsch\xfcss Welt!", invalidate=False)
+        TRANSLATION_CACHE.invalidate("de", globally=False)
+
+        # Stop the reload from happening, the old table should be used without any queries
+        with sleuth.switch("fluent.trans.TRANSLATION_CACHE.refetch_language", lambda *args: None):
+            with sleuth.watch("google.appengine.api.datastore.Query.Run") as query:
+                trans = gettext("Goodbye World!")
+                self.assertEqual(trans, "Auf Wiedersehen Welt!")
+                self.assertFalse(query.called)
+
+        # Wait for the no-op thread to be cleaned up and then reload properly
+        while translations_loading():
+            pass
+
+        TRANSLATION_CACHE.refetch_language("de")
+        self.assertFalse(TRANSLATION_CACHE._stale_translations.get("de"))
+        self.assertEqual(gettext("Goodbye World!"), u"Tsch\xfcss Welt!".encode("utf-8"))
+
+    def test_language_tables_are_compact(self):
+        TRANSLATION_CACHE.refetch_language("en")
+        table = TRANSLATION_CACHE._translations["en"]
+
+        # Strings without a hint are keyed on their text alone
+        forms = table["Hello World!"]
+        self.assertIsInstance(forms, TranslationForms)
+        self.assertTrue("o" in forms)
+        self.assertFalse("h" in forms)
+        self.assertEqual(forms["o"], "Hello World!")
+
+        # The master text and its source language translation are the same object
+        key = [k for k in table if k == "Hello World!"][0]
+        self.assertIs(key, forms["o"])
+
+    def test_reload_only_fetches_changes(self):
+        TRANSLATION_CACHE.refetch_language("de")
+
+        self.mt2.create_or_update_translation("de", u"Tsch\xfcss Welt!")
+        TRANSLATION_CACHE.invalidate("de", globally=False)
+
+        # Add an entry which isn't in the datastore, only a full reload would drop it
+        stale_table = dict(TRANSLATION_CACHE._stale_translations["de"])
+        stale_table["Only cached"] = TranslationForms.from_plural_texts({"o": u"Nur im Cache"})
+        TRANSLATION_CACHE._stale_translations["de"] = stale_table
+
+        TRANSLATION_CACHE.refetch_language("de")
+        self.assertTrue("Only cached" in TRANSLATION_CACHE._translations["de"])
+
+        translation.activate("de")
+        self.assertEqual(gettext("Goodbye World!"), u"Tsch\xfcss Welt!".encode("utf-8"))
+        self.assertEqual(gettext("Hello World!"), "Hallo Welt!")
+
+    def test_full_invalidation_doesnt_reload_from_the_stale_table(self):
+        TRANSLATION_CACHE.refetch_language("de")
+        TRANSLATION_CACHE.invalidate("de", globally=False, full=True)
+
+        # The stale table can still be served, but the reload starts from scratch
+        self.assertTrue("de" in TRANSLATION_CACHE._stale_translations)
+        stale_table = dict(TRANSLATION_CACHE._stale_translations["de"])
+        stale_table["Only cached"] = TranslationForms.from_plural_texts({"o": u"Nur im Cache"})
+        TRANSLATION_CACHE._stale_translations["de"] = stale_table
+
+        TRANSLATION_CACHE.refetch_language("de")
+        self.assertFalse("Only cached" in TRANSLATION_CACHE._translations["de"])
+        self.assertFalse("de" in TRANSLATION_CACHE._full_reload_pending)
+
+    @override_settings(FLUENT_SHARED_SNAPSHOTS=True, FLUENT_SERVE_STALE_TRANSLATIONS=True)
+    def test_stale_table_served_while_waiting_for_the_lease_holder(self):
+        TRANSLATION_CACHE.refetch_language("de")
+        Translation.objects.get(pk=self.mt2.translations_by_language_code["de"]).delete()
+        versions = _get_language_versions(["de"])["de"]
+        # Pretend that another instance is loading the language
+        self.assertTrue(cache.add(_language_lease_key("de", versions), True))
+
+        translation.activate("de")
+        TRANSLATION_CACHE.refetch_language_async("de")
+        TRANSLATION_CACHE._loader.join()
+
+        # The background load doesn't tie up a worker waiting for the snapshot, a later lookup
+        # checks for it again. The stale table is served meanwhile.
+        self.assertFalse("de" in TRANSLATION_CACHE._translations)
+        with sleuth.watch("google.appengine.api.datastore.Query.Run") as query:
+            self.assertEqual(gettext("Hello World!"), "Hallo Welt!")
+            self.assertFalse(query.called)
+
+        # Once it has waited for long enough it loads the language itself
+        TRANSLATION_CACHE._lease_waits["de"] = (versions, 0, 0)
+        TRANSLATION_CACHE.refetch_language_async("de")
+        TRANSLATION_CACHE._loader.join()
+        self.assertFalse("Goodbye World!" in TRANSLATION_CACHE._translations["de"])
+
+    def test_deleting_a_translation_fully_invalidates(self):
+        TRANSLATION_CACHE.refetch_language("de")
+        Translation.objects.get(pk=self.mt2.translations_by_language_code["de"]).delete()
+
+        self.assertFalse("de" in TRANSLATION_CACHE._translations)
+        self.assertTrue("de" in TRANSLATION_CACHE._full_reload_pending)
+        self.assertTrue(cache.get(_language_full_version_key("de")))
+
+    @override_settings(FLUENT_SHARED_SNAPSHOTS=True)
+    def test_languages_loaded_from_shared_snapshot(self):
+        # Use a tiny chunk size to make sure that snapshots are split up
+        with sleuth.switch("fluent.trans._SNAPSHOT_CHUNK_SIZE", 10):
+            TRANSLATION_CACHE.refetch_language("de")
+
+            other_instance = TranslationCache()
+            with sleuth.watch("google.appengine.api.datastore.Query.Run") as query:
+                other_instance.refetch_language("de")
+                self.assertFalse(query.called)
+
+        self.assertEqual(other_instance._translations["de"], TRANSLATION_CACHE._translations["de"])
+
+    @override_settings(FLUENT_SHARED_SNAPSHOTS=True)
+    def test_fully_invalidated_snapshot_is_ignored(self):
+        TRANSLATION_CACHE.refetch_language("de")
+        invalidate_language("de", full=True)
+
+        other_instance = TranslationCache()
+        with sleuth.watch("google.appengine.api.datastore.Query.Run") as query:
+            other_instance.refetch_language("de")
+            self.assertTrue(query.called)
+
+        self.assertEqual(other_instance._translations["de"]["Hello World!"]["o"], u"Hallo Welt!")
+
+    def test_untranslated_strings_only_queried_once_while_loading(self):
+        translation.activate("de")
+
+        # Stop the language from loading, so lookups have to go to the datastore
+        with sleuth.switch("fluent.trans.TRANSLATION_CACHE.refetch_language", lambda *args: None):
+            with sleuth.watch("google.appengine.api.datastore.Query.Run") as query:
+                self.assertEqual(gettext("Not translated"), "Not translated")
+                self.assertTrue(query.called)
+
+            with sleuth.watch("google.appengine.api.datastore.Query.Run") as query:
+                self.assertEqual(gettext("Not translated"), "Not translated")
+                self.assertFalse(query.called)
+
+            # Translated strings are still looked up
+            self.assertEqual(gettext("Hello World!"), "Hallo Welt!")
+
+            # Invalidating the language forgets the untranslated strings
+            invalidate_language("de")
+            with sleuth.watch("google.appengine.api.datastore.Query.Run") as query:
+                gettext("Not translated")
+                self.assertTrue(query.called)
+
+        while translations_loading():
+            pass
+
+    @override_settings(FLUENT_STRING_CACHE=True)
+    def test_fetched_strings_are_cached(self):
+        strings = [("Hello World!", ""), ("Goodbye World!", ""), ("Not translated", "")]
+        results = TRANSLATION_CACHE.fetch_translations(strings, "de")
+        self.assertEqual(results[("Hello World!", "")]["o"], u"Hallo Welt!")
+        self.assertEqual(results[("Goodbye World!", "")]["o"], u"Auf Wiedersehen Welt!")
+        self.assertIsNone(results[("Not translated", "")])
+
+        with sleuth.watch("google.appengine.api.datastore.Query.Run") as query:
+            self.assertEqual(TRANSLATION_CACHE.fetch_translations(strings, "de"), results)
+            self.assertFalse(query.called)
+
+        # Invalidating the language makes the cached strings out of date
+        invalidate_language("de")
+        with sleuth.watch("google.appengine.api.datastore.Query.Run") as query:
+            TRANSLATION_CACHE.fetch_translation("Hello World!", "", "de")
+            self.assertTrue(query.called)
+
+    @override_settings(FLUENT_FALLBACK_QUERIES_PER_REQUEST=1)
+    def test_fallback_queries_are_limited_per_request(self):
+        translation.activate("de")
+        reset_fallback_budget(None)
+
+        # Stop the language from loading, so lookups have to go to the datastore
+        with sleuth.switch("fluent.trans.TRANSLATION_CACHE.refetch_language", lambda *args: None):
+            self.assertEqual(gettext("Hello World!"), "Hallo Welt!")
+
+            # The budget is used up, so the source text is returned and isn't remembered as
+            # untranslated
+            with sleuth.watch("google.appengine.api.datastore.Query.Run") as query:
+                self.assertEqual(gettext("Goodbye World!"), "Goodbye World!")
+                self.assertFalse(query.called)
+            self.assertFalse("Goodbye World!" in TRANSLATION_CACHE._untranslated_strings("de"))
+
+            # Lazy translations don't remember the untranslated text
+            lazy_string = ugettext_lazy("Goodbye World!")
+            self.assertEqual(unicode(lazy_string), u"Goodbye World!")
+
+            reset_fallback_budget(None)
+            self.assertEqual(unicode(lazy_string), u"Auf Wiedersehen Welt!")
+            self.assertEqual(gettext("Goodbye World!"), "Auf Wiedersehen Welt!")
+
+        while translations_loading():
+            pass
+
+    def test_failed_fallback_query_returns_the_source_text(self):
+        translation.activate("de")
+
+        def fail(*args, **kwargs):
+            raise ValueError("Datastore is down")
+
+        with sleuth.switch("fluent.trans.TRANSLATION_CACHE.refetch_language", lambda *args: None):
+            with sleuth.switch("google.appengine.api.datastore.Query.Run", fail):
+                self.assertEqual(gettext("Hello World!"), "Hello World!")
+            self.assertFalse("Hello World!" in TRANSLATION_CACHE._untranslated_strings("de"))
+
+        while translations_loading():
+            pass
+
+    @override_settings(FLUENT_FALLBACK_SLOW_QUERY=0, FLUENT_FALLBACK_COOLDOWN=60)
+    def test_slow_fallback_query_opens_the_breaker(self):
+        breaker = TRANSLATION_CACHE._breaker
+        breaker.open_until = 0
+        self.addCleanup(setattr, breaker, "open_until", 0)
+
+        results = TRANSLATION_CACHE.fetch_translations([("Hello World!", "")], "de")
+        self.assertEqual(results[("Hello World!", "")]["o"], u"Hallo Welt!")
+        self.assertEqual(fallback_breaker_stats()["state"], "open")
+
+        with sleuth.watch("google.appengine.api.datastore.Query.Run") as query:
+            self.assertEqual(TRANSLATION_CACHE.fetch_translations([("Goodbye World!", "")], "de"), {})
+            self.assertFalse(query.called)
+
+    @override_settings(FLUENT_REPORT_MISSING_TRANSLATIONS=True)
+    def test_missing_translations_are_reported(self):
+        TRANSLATION_CACHE.refetch_language("de")
+        translation.activate("de")
+        flush_missing_translations()
+
+        for i in xrange(3):
+            self.assertEqual(gettext("Not translated"), "Not translated")
+        self.assertEqual(gettext("Hello World!"), "Hallo Welt!")
+
+        # Nothing is written until the counts are flushed, and then in a single task
+        self.assertFalse(MissingTranslation.objects.exists())
+        flush_missing_translations()
+        self.process_task_queues()
+
+        report = MissingTranslation.objects.get()
+        self.assertEqual((report.text, report.hint, report.language_code), (u"Not translated", u"", "de"))
+        self.assertEqual(report.count, 3)
+
+        gettext("Not translated")
+        flush_missing_translations()
+        self.process_task_queues()
+        self.assertEqual(MissingTranslation.objects.get().count, 4)
+
+    def test_report_flushes_are_split_and_safe_to_retry(self):
+        flush_missing_translations()
+        for i in xrange(3):
+            _missing_translations.hit((u"String {}".format(i), u"", "de"))
+
+        with sleuth.switch("fluent.trans._REPORT_ROWS_PER_TASK", 2):
+            with sleuth.watch("fluent.trans.defer") as defer:
+                flush_missing_translations()
+                self.assertEqual(len(defer.calls), 2)
+        self.process_task_queues()
+        self.assertEqual(MissingTranslation.objects.count(), 3)
+
+        # Running a task again doesn't add its counts twice
+        _add_counts(*defer.calls[0].args[1:])
+        self.assertEqual(sorted(MissingTranslation.objects.values_list("count", flat=True)), [1, 1, 1])
+
+        # Counts which couldn't be queued are written by the next flush
+        def broken_defer(*args, **kwargs):
+            raise ValueError("Task queue is down")
+
+        _missing_translations.hit((u"String 0", u"", "de"))
+        with sleuth.switch("fluent.trans.defer", broken_defer):
+            flush_missing_translations()
+        flush_missing_translations()
+        self.process_task_queues()
+
+        report = MissingTranslation.objects.get(pk=MissingTranslation.generate_key(u"String 0", u"", "de"))
+        self.assertEqual(report.count, 2)
+
+    @override_settings(FLUENT_REPORT_MISSING_TRANSLATIONS=True, FLUENT_FALLBACK_QUERIES_PER_REQUEST=0)
+    def test_strings_which_werent_fetched_arent_reported(self):
+        translation.activate("de")
+        flush_missing_translations()
+
+        # Stop the language from loading, the breaker then refuses to fetch each string
+        with sleuth.switch("fluent.trans.TRANSLATION_CACHE.refetch_language", lambda *args: None):
+            self.assertEqual(gettext("Not translated"), "Not translated")
+            self.assertEqual(gettext_many([("Hello World!", "", 1)]), [u"Hello World!"])
+
+        flush_missing_translations()
+        self.process_task_queues()
+        self.assertFalse(MissingTranslation.objects.exists())
+
+        while translations_loading():
+            pass
+
+    @override_settings(FLUENT_USAGE_SAMPLE_RATE=1)
+    def test_string_usage_is_counted(self):
+        TRANSLATION_CACHE.refetch_language("de")
+        translation.activate("de")
+        flush_string_usage()
+
+        gettext("Hello World!")
+        gettext("Hello World!")
+        unicode(TranslatableContent(text=u"Hello World!"))
+        gettext_many([("Hello World!", "", 1), ("Goodbye World!", "", 1)])
+
+        self.assertFalse(StringUsage.objects.exists())
+        flush_string_usage()
+        self.process_task_queues()
+
+        usage = StringUsage.objects.get(pk=Translation.generate_hash(u"Hello World!", u""))
+        self.assertEqual(usage.count, 4)
+        self.assertEqual(hot_strings(), [(u"Hello World!", u""), (u"Goodbye World!", u"")])
+
+        # Nothing is counted unless sampling is enabled
+        with override_settings(FLUENT_USAGE_SAMPLE_RATE=0):
+            gettext("Hello World!")
+        flush_string_usage()
+        self.process_task_queues()
+        self.assertEqual(StringUsage.objects.get(pk=usage.pk).count, 4)
+
+    @override_settings(FLUENT_USAGE_SAMPLE_RATE=1)
+    def test_string_usage_of_utf8_bytestrings(self):
+        flush_string_usage()
+        _sample_usage("\xc3\x85ukasz", "")
+        flush_string_usage()
+        self.process_task_queues()
+        self.assertEqual(StringUsage.objects.get().text, u"\xc5ukasz")
+
+    @override_settings(FLUENT_INVALIDATION_CHECK_INTERVAL=60)
+    def test_invalidation_checks_are_rate_limited(self):
+        TRANSLATION_CACHE.refetch_language("de")
+        check_for_invalidations()
+
+        with sleuth.watch("fluent.trans.check_for_invalidations") as check:
+            invalidate_caches_if_necessary(None)
+            self.assertFalse(check.called)
+
+        with override_settings(FLUENT_INVALIDATION_CHECK_INTERVAL=0):
+            with sleuth.watch("fluent.trans.check_for_invalidations") as check:
+                invalidate_caches_if_necessary(None)
+                self.assertTrue(check.called)
+
+    def test_evicted_version_counts_as_an_invalidation(self):
+        _bump_language_version("de")
+        TRANSLATION_CACHE.refetch_language("de")
+
+        cache.clear()
+        check_for_invalidations()
+        self.assertFalse("de" in TRANSLATION_CACHE._translations)
+
+        while translations_loading():
+            pass
+
+    def test_edits_are_patched_into_the_loaded_table(self):
+        TRANSLATION_CACHE.refetch_language("de")
+        other_instance = TranslationCache()
+        other_instance.refetch_language("de")
+        loaded_versions = other_instance._translation_versions["de"]
+
+        self.mt2.create_or_update_translation("de", u"Tsch\xfcss Welt!")
+
+        # This instance's table was patched rather than invalidated
+        translation.activate("de")
+        with sleuth.watch("google.appengine.api.datastore.Query.Run") as query:
+            self.assertEqual(gettext("Goodbye World!"), u"Tsch\xfcss Welt!".encode("utf-8"))
+            self.assertFalse(query.called)
+
+        # Other instances patch the edited translation in from the change message
+        versions = _get_language_versions(["de"])["de"]
+        self.assertTrue(other_instance.apply_changes("de", loaded_versions, versions))
+        self.assertEqual(other_instance._translations["de"]["Goodbye World!"]["o"], u"Tsch\xfcss Welt!")
+        self.assertEqual(other_instance._translation_versions["de"], versions)
+
+        # Invalidating the whole language can't be patched
+        invalidate_language("de")
+        self.assertFalse(other_instance.apply_changes("de", versions, _get_language_versions(["de"])["de"]))
+
+    @override_settings(FLUENT_SHARED_SNAPSHOTS=True)
+    def test_waits_for_the_instance_holding_the_lease(self):
+        TRANSLATION_CACHE.refetch_language("de")
+        versions = TRANSLATION_CACHE._translation_versions["de"]
+
+        # Pretend that another instance is still loading the language
+        manifest_key = _language_snapshot_key("de")
+        manifest = cache.get(manifest_key)
+        cache.delete(manifest_key)
+        self.assertFalse(cache.add(_language_lease_key("de", versions), True))
+
+        publish = threading.Timer(0.5, cache.set, args=(manifest_key, manifest))
+        publish.start()
+
+        other_instance = TranslationCache()
+        with sleuth.watch("google.appengine.api.datastore.Query.Run") as query:
+            other_instance.refetch_language("de")
+            self.assertFalse(query.called)
+
+        publish.join()
+        self.assertEqual(other_instance._translations["de"], TRANSLATION_CACHE._translations["de"])
+
+    @override_settings(FLUENT_SHARED_SNAPSHOTS=True)
+    def test_loads_itself_if_lease_holder_never_publishes(self):
+        TRANSLATION_CACHE.refetch_language("de")
+        versions = TRANSLATION_CACHE._translation_versions["de"]
+        cache.delete(_language_snapshot_key("de"))
+
+        other_instance = TranslationCache()
+        with sleuth.switch("fluent.trans._LEASE_WAIT", 0):
+            with sleuth.watch("google.appengine.api.datastore.Query.Run") as query:
+                other_instance.refetch_language("de")
+                self.assertTrue(query.called)
+
+        self.assertTrue(cache.get(_language_lease_key("de", versions)))
+        self.assertEqual(other_instance._translations["de"]["Hello World!"]["o"], u"Hallo Welt!")
+
+    def test_prewarm_translations(self):
+        prewarm_translations(["de", "es"], workers=2)
+
+        self.assertEqual(TRANSLATION_CACHE._translations["de"]["Hello World!"]["o"], u"Hallo Welt!")
+        self.assertEqual(TRANSLATION_CACHE._translations["es"]["Hello World!"]["o"], u"Hola Mundo!")
+        self.assertFalse("fr" in TRANSLATION_CACHE._translations)
+
+    @override_settings(FLUENT_LANGUAGE_IDLE_TIMEOUT=60)
+    def test_idle_languages_are_evicted(self):
+        other_instance = TranslationCache()
+        other_instance.refetch_language("de")
+        other_instance.refetch_language("es")
+        self.assertEqual(other_instance.evict_idle_languages(), [])
+
+        other_instance._last_access["de"] = time.time() - 120
+        self.assertEqual(other_instance.evict_idle_languages(), ["de"])
+        self.assertFalse("de" in other_instance._translations)
+        self.assertFalse("de" in other_instance._translation_versions)
+        self.assertTrue("es" in other_instance._translations)
+        self.assertEqual(other_instance.evictions, 1)
+
+        # Using the language again loads it again
+        other_instance.get_translation("Hello World!", "", "de")
+        other_instance._loader.join()
+        self.assertTrue("de" in other_instance._translations)
+
+    @override_settings(FLUENT_MAX_LOADED_STRINGS=1)
+    def test_least_recently_used_languages_are_evicted_over_budget(self):
+        other_instance = TranslationCache()
+        other_instance.refetch_language("de")
+        other_instance.refetch_language("es")
+        other_instance.get_translation("Hello World!", "", "es")
+
+        # German has two strings, and was used less recently
+        self.assertEqual(other_instance.evict_idle_languages(), ["de"])
+        self.assertEqual(other_instance.evict_idle_languages(), [])
+
+    @override_settings(FLUENT_GROUP_PARTITIONS=True)
+    def test_languages_load_by_group(self):
+        from fluent.scanner import _sync_translation_groups
+
+        self.mt.used_by_groups_in_code_or_templates = {"website"}
+        self.mt.save()
+        _sync_translation_groups(self.mt)
+        self.mt2.used_by_groups_in_code_or_templates = {"admin"}
+        self.mt2.save()
+        _sync_translation_groups(self.mt2)
+
+        other_instance = TranslationCache()
+        other_instance.refetch_group("de", "website")
+        self.assertEqual(other_instance._group_tables[("de", "website")].keys(), ["Hello World!"])
+
+        # Strings are looked up in the default group, and those which aren't in it are
+        # still translated
+        self.assertEqual(other_instance.get_translation("Hello World!", "", "de")["o"], u"Hallo Welt!")
+        self.assertEqual(
+            other_instance.get_translation("Goodbye World!", "", "de")["o"], u"Auf Wiedersehen Welt!"
+        )
+        other_instance._loader.join()
+        self.assertFalse(("de", "admin") in other_instance._group_tables)
+        self.assertFalse("de" in other_instance._translations)
+
+        # Invalidating keeps the table as the base for an incremental reload
+        other_instance.invalidate("de", globally=False)
+        self.assertFalse(("de", "website") in other_instance._group_tables)
+        self.assertTrue(("de", "website") in other_instance._stale_group_tables)
+
+    def test_full_tables_arent_prewarmed_with_group_partitions(self):
+        snapshot_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, snapshot_dir)
+        path = os.path.join(snapshot_dir, "translations.snapshot")
+        write_translation_snapshot(path, ["de"])
+        TRANSLATION_CACHE.invalidate(globally=False)
+
+        with override_settings(FLUENT_GROUP_PARTITIONS=True):
+            with sleuth.watch("google.appengine.api.datastore.Query.Run") as query:
+                prewarm_translations(["de", "es"], workers=2)
+                self.assertEqual(load_translation_snapshot(path), [])
+                self.assertFalse(query.called)
+
+        self.assertFalse("de" in TRANSLATION_CACHE._translations)
+        self.assertFalse("es" in TRANSLATION_CACHE._translations)
+
+    @override_settings(
+        LANGUAGES=[("en", "English"), ("de", "German"), ("de-at", "Austrian German")],
+        FLUENT_DIALECT_FALLBACK=True,
+    )
+    def test_dialects_are_merged_with_their_root_language(self):
+        self.mt.create_or_update_translation("de-at", u"Servus Welt!")
+
+        TRANSLATION_CACHE.refetch_language("de-at")
+        table = TRANSLATION_CACHE._translations["de-at"]
+        self.assertEqual(table["Hello World!"]["o"], u"Servus Welt!")
+        self.assertEqual(table["Goodbye World!"]["o"], u"Auf Wiedersehen Welt!")
+
+        # Changes to the root language reload the dialect
+        _bump_language_version("de")
+        with sleuth.watch("fluent.trans.TRANSLATION_CACHE.refetch_language_async") as refetch:
+            check_for_invalidations()
+            self.assertTrue(refetch.called)
+            self.assertEqual(refetch.calls[0].args[0], "de-at")
+
+    def test_language_resolvers_are_cached(self):
+        resolver = _get_resolver("de")
+        self.assertIs(resolver, _get_resolver("de"))
+        self.assertEqual(resolver.singular_index, "o")
+        self.assertEqual(resolver.plural_index(2), "h")
+
+        # They're worked out again when the settings they depend on change
+        with override_settings(LANGUAGE_CODE="de", FLUENT_SOURCE_LANGUAGE_FAST_PATH=True):
+            self.assertTrue(_get_resolver("de").is_source)
+        self.assertFalse(_get_resolver("de").is_source)
+
+    def test_lazy_translations_are_remembered(self):
+        lazy_string = ugettext_lazy("Hello World!")
+
+        translation.activate("de")
+        TRANSLATION_CACHE.refetch_language("de")
+        self.assertEqual(unicode(lazy_string), u"Hallo Welt!")
+
+        with sleuth.watch("fluent.trans._get_trans") as get_trans:
+            self.assertEqual(unicode(lazy_string), u"Hallo Welt!")
+            self.assertEqual(lazy_string, u"Hallo Welt!")
+            self.assertFalse(get_trans.called)
+
+        # Changing the translation or the language translates it again
+        self.mt.create_or_update_translation("de", u"Hallo Erde!")
+        self.assertEqual(unicode(lazy_string), u"Hallo Erde!")
+
+        translation.activate("es")
+        self.assertEqual(unicode(lazy_string), u"Hola Mundo!")
+
+    def test_lazy_translations_behave_like_strings(self):
+        translation.activate("de")
+        TRANSLATION_CACHE.refetch_language("de")
+        hello = ugettext_lazy("Hello World!")
+        goodbye = ugettext_lazy("Goodbye World!")
+
+        self.assertTrue(goodbye < hello)
+        self.assertTrue(goodbye <= hello)
+        self.assertTrue(hello > goodbye)
+        self.assertTrue(hello >= u"Hallo Welt!")
+        self.assertTrue(u"Hallo Welt!" >= hello)
+        self.assertEqual(max(hello, goodbye), u"Hallo Welt!")
+        self.assertEqual(sorted([goodbye, hello], reverse=True), [hello, goodbye])
+
+        self.assertEqual(hello * 2, u"Hallo Welt!Hallo Welt!")
+        self.assertEqual(2 * hello, u"Hallo Welt!Hallo Welt!")
+        self.assertEqual(u"%s!" % hello, u"Hallo Welt!!")
+        self.assertEqual(ugettext_lazy("%s") % hello, u"Hallo Welt!")
+
+    def test_gettext_many_fetches_missing_strings_together(self):
+        items = [
+            ("Hello World!", "", 1),
+            ("Untranslated", "", 1),
+            ("Goodbye World!", "", 1),
+            ("", "", 1),
+        ]
+
+        # Keep the language from loading, so that everything has to be fetched
+        with sleuth.switch("fluent.trans.TRANSLATION_CACHE.refetch_language", lambda *args: None):
+            with sleuth.watch("fluent.trans.TRANSLATION_CACHE.fetch_translations") as fetch:
+                self.assertEqual(
+                    gettext_many(items, "de"),
+                    [u"Hallo Welt!", u"Untranslated", u"Auf Wiedersehen Welt!", u""]
+                )
+                self.assertEqual(len(fetch.calls), 1)
+            TRANSLATION_CACHE._loader.join()
+
+        self.assertTrue("Untranslated" in TRANSLATION_CACHE._untranslated["de"])
+
+        TRANSLATION_CACHE.refetch_language("de")
+        translation.activate("de")
+        self.assertEqual(gettext_many([("Hello World!", "", 1)]), [u"Hallo Welt!"])
+
+    @override_settings(FLUENT_SOURCE_LANGUAGE_FAST_PATH=True, LANGUAGE_CODE="en")
+    def test_source_language_only_loads_overrides(self):
+        TRANSLATION_CACHE.refetch_language("en")
+        self.assertEqual(TRANSLATION_CACHE._translations["en"], {})
+
+        self.mt2.create_or_update_translation("en", u"Bye World!")
+        TRANSLATION_CACHE.invalidate("en", globally=False, full=True)
+        TRANSLATION_CACHE.refetch_language("en")
+        self.assertEqual(TRANSLATION_CACHE._translations["en"].keys(), ["Goodbye World!"])
+
+        translation.activate("en")
+        self.assertEqual(gettext("Hello World!"), "Hello World!")
+        self.assertEqual(gettext("Goodbye World!"), "Bye World!")
+        self.assertEqual(ungettext("One apple", "{} apples", 2), u"{} apples")
+        self.assertEqual(
+            gettext_many([("One apple", "", 2, "{} apples"), ("One apple", "", 1, "{} apples")]),
+            [u"{} apples", u"One apple"]
+        )
+
+    @override_settings(FLUENT_SOURCE_LANGUAGE_FAST_PATH=True, LANGUAGE_CODE="en")
+    def test_source_language_isnt_fetched_while_loading(self):
+        self.mt2.create_or_update_translation("en", u"Bye World!")
+
+        other_instance = TranslationCache()
+        with sleuth.watch("google.appengine.api.datastore.Query.Run") as query:
+            with sleuth.switch("fluent.trans.TranslationCache.refetch_language_async", lambda *args: None):
+                self.assertIsNone(other_instance.get_translation("Goodbye World!", "", "en"))
+                self.assertEqual(
+                    other_instance.get_translations([("Goodbye World!", "")], "en"),
+                    {("Goodbye World!", ""): None}
+                )
+            self.assertFalse(query.called)
+
+        # Group partitions of the source language only hold the overrides too
+        from fluent.scanner import _sync_translation_groups
+        for master in (self.mt, self.mt2):
+            master.used_by_groups_in_code_or_templates = {"website"}
+            master.save()
+            _sync_translation_groups(master)
+
+        other_instance.refetch_group("en", "website")
+        self.assertEqual(other_instance._group_tables[("en", "website")].keys(), ["Goodbye World!"])
+
+    @override_settings(FLUENT_PARTIAL_LANGUAGES={"de": 1})
+    def test_partial_languages_keep_recently_used_strings(self):
+        other_instance = TranslationCache()
+        self.assertEqual(other_instance.get_translation("Hello World!", "", "de")["o"], u"Hallo Welt!")
+        self.assertEqual(other_instance.get_translation("Hello World!", "", "de")["o"], u"Hallo Welt!")
+        self.assertEqual(
+            other_instance.get_translation("Goodbye World!", "", "de")["o"], u"Auf Wiedersehen Welt!"
+        )
+
+        # The language is never loaded in full
+        self.assertFalse(other_instance._loader.busy())
+        self.assertFalse("de" in other_instance._translations)
+        self.assertEqual(other_instance._partial_tables["de"].stats(), {
+            "capacity": 1, "size": 1, "hits": 1, "misses": 2, "evictions": 1,
+        })
+
+        # Edits aren't fetched to patch a table which doesn't exist
+        loaded_versions = other_instance._translation_versions["de"]
+        self.mt.create_or_update_translation("de", u"Hallo Erde!")
+        with sleuth.watch("google.appengine.api.datastore.Get") as get:
+            self.assertFalse(
+                other_instance.apply_changes("de", loaded_versions, _get_language_versions(["de"])["de"])
+            )
+            self.assertFalse(get.called)
+
+        other_instance.invalidate("de", globally=False)
+        self.assertEqual(other_instance._partial_tables["de"].stats()["size"], 0)
+
+    def test_translation_snapshot_file(self):
+        snapshot_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, snapshot_dir)
+        path = os.path.join(snapshot_dir, "translations.snapshot")
+        write_translation_snapshot(path, ["de", "es"])
+
+        self.mt.create_or_update_translation("de", u"Hallo Erde!")
+        Translation.objects.get(pk=self.mt.translations_by_language_code["es"]).delete()
+        TRANSLATION_CACHE.invalidate(globally=False)
+
+        self.assertEqual(load_translation_snapshot(path), ["de"])
+
+        # Changes since the snapshot was written are applied on top of it
+        self.assertEqual(TRANSLATION_CACHE._translations["de"]["Hello World!"]["o"], u"Hallo Erde!")
+        self.assertEqual(TRANSLATION_CACHE._translations["de"]["Goodbye World!"]["o"], u"Auf Wiedersehen Welt!")
+
+        # The deletion was a full invalidation, so the Spanish table isn't used
+        self.assertFalse("es" in TRANSLATION_CACHE._translations)
+
+    def test_background_loads_are_deduplicated_and_report_errors(self):
+        release = threading.Event()
+
+        def broken_refetch(language_code):
+            release.wait(5)
+            raise ValueError("Datastore is down")
+
+        errors = loader_stats()["errors"]
+        with sleuth.switch("fluent.trans.TRANSLATION_CACHE.refetch_language", broken_refetch):
+            TRANSLATION_CACHE.refetch_language_async("de")
+            TRANSLATION_CACHE.refetch_language_async("de")
+            self.assertEqual(loader_stats()["pending"], 1)
+
+            release.set()
+            TRANSLATION_CACHE._loader.join()
+
+        self.assertFalse(translations_loading())
+        self.assertEqual(loader_stats()["errors"], errors + 1)
+        self.assertFalse("de" in TRANSLATION_CACHE._translations)
+
+    def test_loader_pool_after_fork(self):
+        # Without workers the load stays pending, like one queued in the parent process
+        max_workers = [0]
+        pool = _LoaderPool(lambda: max_workers[0])
+        self.assertTrue(pool.submit("de", lambda: None))
+        self.assertFalse(pool.submit("de", lambda: None))
+
+        # Pretend that we were forked, the pending load won't run in this process
+        pool._pid = -1
+        max_workers[0] = 1
+        loaded = threading.Event()
+        self.assertTrue(pool.submit("de", loaded.set))
+        pool.join(5)
+        self.assertTrue(loaded.is_set())
+
+    @override_settings(FLUENT_JOIN_LOADERS_AT_REQUEST_END=True)
+    def test_loader_threads_exit_when_joined_at_request_end(self):
+        pool = _LoaderPool(1)
+        pool.submit("de", lambda: None)
+        pool.join()
+
+        # The worker exits straight away rather than waiting for more work
+        deadline = time.time() + 1
+        while pool.stats()["workers"] and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(pool.stats()["workers"], 0)
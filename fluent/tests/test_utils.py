@@ -3,7 +3,7 @@ from djangae.test import TestCase
 from django.test import override_settings
 
 # FLUENT
-from fluent.utils import find_closest_supported_language
+from fluent.utils import find_closest_supported_language, language_fallback_chain
 
 
 class UtilsTestCase(TestCase):
@@ -31,3 +31,14 @@ class UtilsTestCase(TestCase):
         # If there is no sensible match then it should raise ValueError
         with override_settings(LANGUAGES=[('fr', 'Francais')]):
             self.assertRaises(ValueError, find_closest_supported_language, "en")
+
+    def test_language_fallback_chain(self):
+        with override_settings(LANGUAGES=[('pt', 'Portuguese'), ('pt-br', 'Brazilian Portuguese')]):
+            self.assertEqual(language_fallback_chain("pt-br"), ("pt-br", "pt"))
+            self.assertEqual(language_fallback_chain("pt"), ("pt",))
+            self.assertEqual(find_closest_supported_language("pt-pt"), "pt")
+
+        # Dialects only fall back to a supported root language
+        with override_settings(LANGUAGES=[('pt-br', 'Brazilian Portuguese')]):
+            self.assertEqual(language_fallback_chain("pt-br"), ("pt-br",))
+            self.assertEqual(find_closest_supported_language("pt-pt"), "pt-br")
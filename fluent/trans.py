@@ -1,108 +1,1569 @@
+import os
 import threading
 import logging
+import Queue
 import datetime
+import random
+import time
+import uuid
+import zlib
+import cPickle
+from collections import OrderedDict
+from contextlib import contextmanager
+from functools import partial
 
 from django.conf import settings
 from django.core.cache import cache
+from django.core.signals import setting_changed
+from django.utils import timezone
+from django.utils.encoding import force_text
 
 
-from fluent.cldr.rules import get_plural_index
-from fluent.models import Translation
+from fluent.cldr.rules import get_rules_for_language, ZERO, ONE, TWO, FEW, MANY, OTHER
+from fluent.models import MissingTranslation, StringUsage, Translation
+from fluent.utils import language_fallback_chain
 
 from djangae.db import transaction
+from google.appengine.ext.deferred import defer
 
 logger = logging.getLogger(__file__)
 
+# How far back to look for changes when refreshing a language incrementally. This has to cover
+# the time it takes for a write to show up in datastore queries.
+_DELTA_REFRESH_OVERLAP = datetime.timedelta(seconds=60)
 
-def _language_invalidation_key(language_code):
-    return "fluent_{}_invalidated_at".format(language_code)
+# Snapshots are split so that each chunk fits within the memcache value size limit
+_SNAPSHOT_CHUNK_SIZE = 1000 * 1000
+_SNAPSHOT_TIMEOUT = 60 * 60 * 24
 
+# When one instance holds the lease to load a language from the datastore, the others wait
+# up to _LEASE_WAIT seconds for its snapshot before loading it themselves
+_LEASE_TIMEOUT = 60
+_LEASE_WAIT = 10
+_LEASE_POLL_INTERVAL = 0.25
 
-def _translation_to_dict(trans):
-    data = {"singular": trans.text, "plurals": trans.plural_texts}
-    data.update(trans.plural_texts)
-    return data
+# Loader threads exit after being idle for this many seconds
+_LOADER_IDLE_TIMEOUT = 5
+
+# The maximum number of strings remembered as untranslated per language
+_UNTRANSLATED_LIMIT = 10000
+
+_STRING_CACHE_TIMEOUT = 60 * 60
+
+# The maximum number of distinct strings counted between flushes of the missing translation
+# and string usage reports
+_MISSING_REPORT_LIMIT = 10000
+_USAGE_REPORT_LIMIT = 10000
+
+# Counts are written by tasks of at most this many rows (and about this much text, to keep
+# the payload small), a cross-group transaction per _REPORT_ROWS_PER_TRANSACTION of them
+_REPORT_ROWS_PER_TASK = 200
+_REPORT_TASK_SIZE = 50 * 1000
+_REPORT_ROWS_PER_TRANSACTION = 25
+
+# The datastore limits the number of values in an __in query
+_MAX_HASHES_PER_QUERY = 30
+
+# pk__in lookups are done as a batch get, which the datastore limits to 1000 keys
+_MAX_KEYS_PER_GET = 1000
+
+# Beyond this many versions behind, a language is reloaded rather than patched
+_MAX_PATCHED_VERSIONS = 50
+_CHANGE_TIMEOUT = 60 * 60
+
+
+def _language_version_key(language_code):
+    return "fluent_{}_version".format(language_code)
+
+
+def _language_full_version_key(language_code):
+    return "fluent_{}_full_version".format(language_code)
+
+
+def _language_change_key(language_code, version):
+    return "fluent_{}_change_{}".format(language_code, version)
+
+
+def _language_snapshot_key(language_code):
+    return "fluent_{}_snapshot".format(language_code)
+
+
+def _language_snapshot_chunk_key(language_code, token, index):
+    return "fluent_{}_snapshot_{}_{}".format(language_code, token, index)
+
+
+def _language_lease_key(language_code, versions):
+    return "fluent_{}_lease_{}_{}".format(language_code, *versions)
+
+
+def _language_string_key(language_code, master_hash):
+    return "fluent_{}_string_{}".format(language_code, master_hash)
+
+
+# The settings which are checked on every lookup, see _lookup_setting
+_lookup_settings = {}
+
+
+def _lookup_setting(name, default):
+    """ Returns getattr(settings, name, default), remembered until the setting is changed.
+        Settings which aren't set are looked up (and an AttributeError raised and caught) every
+        time they're read, which is too slow for the settings checked on every lookup.
+    """
+    try:
+        return _lookup_settings[name]
+    except KeyError:
+        value = _lookup_settings[name] = getattr(settings, name, default)
+        return value
+
+
+def _clear_lookup_setting(sender, setting, **kwargs):
+    _lookup_settings.pop(setting, None)
+
+
+setting_changed.connect(_clear_lookup_setting, dispatch_uid="fluent.clear_lookup_setting")
+
+
+def _use_string_cache():
+    """ If enabled, translations of individual strings fetched from the datastore are kept in
+        the cache, so that other instances don't need to query for them.
+    """
+    return getattr(settings, "FLUENT_STRING_CACHE", False)
+
+
+def _use_shared_snapshots():
+    """ If enabled, loaded language tables are published to the cache so that other
+        instances can load them from there instead of querying the datastore.
+    """
+    return getattr(settings, "FLUENT_SHARED_SNAPSHOTS", False)
+
+
+def _invalidation_check_interval():
+    """ The number of seconds between checks of the language versions in the cache. """
+    return getattr(settings, "FLUENT_INVALIDATION_CHECK_INTERVAL", 5)
+
+
+def _get_language_versions(language_codes):
+    """ Returns a dict of language code to its (version, full_version) pair from the cache,
+        using a single get_many. Every invalidation of a language increments its version,
+        and full invalidations also increment its full version.
+    """
+    keys = {
+        code: (_language_version_key(code), _language_full_version_key(code))
+        for code in language_codes
+    }
+    values = cache.get_many([key for pair in keys.values() for key in pair])
+    return {
+        code: (values.get(version_key), values.get(full_version_key))
+        for code, (version_key, full_version_key) in keys.iteritems()
+    }
+
+
+def _ensure_full_version(language_code):
+    """ Set the full version of a language if it has never been set (or has been evicted), for
+        data which is only valid while the full version is unchanged. Otherwise that data
+        would record None, and nothing could tell whether it had been invalidated since.
+    """
+    if cache.add(_language_full_version_key(language_code), random.randint(1, 2 ** 31), timeout=None):
+        logger.info("Initialised the full version of %s", language_code)
+
+
+def _bump_language_version(language_code, full=False):
+    """ Increment the version of a language, returns the new version. """
+    keys = [_language_version_key(language_code)]
+    if full:
+        keys.append(_language_full_version_key(language_code))
+
+    new_versions = []
+    for key in keys:
+        try:
+            new_versions.append(cache.incr(key))
+        except ValueError:
+            # The counter was never set or has been evicted. Start from a random value so that
+            # an instance which loaded at the evicted version doesn't mistake it for this one.
+            start = random.randint(1, 2 ** 31)
+            if cache.add(key, start, timeout=None):
+                new_versions.append(start)
+            else:
+                new_versions.append(cache.incr(key))
+    return new_versions[0]
+
+
+def _loader_timeout():
+    """ The number of seconds after which a load is considered stuck, and can be retried. """
+    return getattr(settings, "FLUENT_LOADER_TIMEOUT", 60)
+
+
+def _fallback_query_budget():
+    """ The number of datastore queries for strings of languages which aren't loaded that can
+        be made per request and per second, None for no limit.
+    """
+    return (
+        getattr(settings, "FLUENT_FALLBACK_QUERIES_PER_REQUEST", None),
+        getattr(settings, "FLUENT_FALLBACK_QUERIES_PER_SECOND", None),
+    )
+
+
+def _fallback_slow_query():
+    """ The number of seconds after which a fallback query is considered slow (None to never),
+        and the number of seconds that no more are made for once one is.
+    """
+    return (
+        getattr(settings, "FLUENT_FALLBACK_SLOW_QUERY", None),
+        getattr(settings, "FLUENT_FALLBACK_COOLDOWN", 30),
+    )
+
+
+def _join_loaders_at_request_end():
+    """ If enabled, the end of each request waits for the background loads, for runtimes which
+        don't allow threads to outlive a request.
+    """
+    return getattr(settings, "FLUENT_JOIN_LOADERS_AT_REQUEST_END", False)
+
+
+def _partial_capacity(language_code):
+    """ Languages listed in FLUENT_PARTIAL_LANGUAGES (a dict of language code to capacity)
+        are never loaded in full. Instead up to `capacity` of their most recently used
+        strings are kept, so the memory they use doesn't grow with the number of strings.
+    """
+    return _lookup_setting("FLUENT_PARTIAL_LANGUAGES", {}).get(language_code)
+
+
+def _language_idle_timeout():
+    """ Loaded languages which haven't been used for this many seconds are evicted. """
+    return getattr(settings, "FLUENT_LANGUAGE_IDLE_TIMEOUT", None)
+
+
+def _max_loaded_strings():
+    """ While the loaded tables hold more strings than this, the least recently used
+        languages are evicted.
+    """
+    return getattr(settings, "FLUENT_MAX_LOADED_STRINGS", None)
+
+
+def _table_size(table):
+    """ The number of strings `table` keeps in memory. Those in a mapped catalog are shared
+        with other processes, so only its overlay counts.
+    """
+    return len(table.overlay) if hasattr(table, "patched") else len(table)
+
+
+def _is_source_language(language_code):
+    """ If FLUENT_SOURCE_LANGUAGE_FAST_PATH is set, the table of the source language
+        (LANGUAGE_CODE) only holds the translations which differ from their master text, and
+        the master text is returned for everything else.
+    """
+    return (
+        getattr(settings, "FLUENT_SOURCE_LANGUAGE_FAST_PATH", False) and
+        language_code == settings.LANGUAGE_CODE
+    )
+
+
+def _fallback_language(language_code):
+    """ If FLUENT_DIALECT_FALLBACK is set, the table of a dialect (e.g. pt-br) is merged with
+        the translations of its root language (e.g. pt), so that strings which haven't been
+        translated into the dialect are found with a single lookup. Returns the root
+        language, or None.
+    """
+    if not getattr(settings, "FLUENT_DIALECT_FALLBACK", False):
+        return None
+
+    chain = language_fallback_chain(language_code)
+    return chain[1] if len(chain) > 1 else None
+
+
+def _use_group_partitions():
+    """ If enabled, languages are loaded in partitions per translation group (as found by the
+        scanner) rather than in full, and only the partitions which are used get loaded.
+    """
+    return _lookup_setting("FLUENT_GROUP_PARTITIONS", False)
+
+
+def _group_miss_capacity():
+    """ The number of strings per language which aren't in the partition of the group they
+        were looked up in (e.g. content of translatable fields) kept in memory.
+    """
+    return getattr(settings, "FLUENT_GROUP_MISS_CAPACITY", 1000)
+
+
+_active_groups = threading.local()
+
+
+@contextmanager
+def translation_group(group):
+    """ Look up the strings translated within the block in the partition of `group`, used by
+        the trans and blocktrans tags as Django resolves their strings itself.
+    """
+    previous = getattr(_active_groups, "group", None)
+    _active_groups.group = group
+    try:
+        yield
+    finally:
+        _active_groups.group = previous
+
+
+def _active_group():
+    group = getattr(_active_groups, "group", None)
+    if group is None:
+        from fluent.scanner import DEFAULT_TRANSLATION_GROUP
+        group = DEFAULT_TRANSLATION_GROUP
+    return group
+
+
+def _report_missing_translations():
+    """ If enabled, lookups of strings which have no translation are counted and written to
+        the MissingTranslation report in batches.
+    """
+    return _lookup_setting("FLUENT_REPORT_MISSING_TRANSLATIONS", False)
+
+
+def _usage_sample_rate():
+    """ The fraction of lookups which are counted towards the StringUsage report, 0 to not
+        count any.
+    """
+    return _lookup_setting("FLUENT_USAGE_SAMPLE_RATE", 0)
+
+
+def _report_flush_interval():
+    """ The number of seconds between writes of the counts collected in memory. """
+    return getattr(settings, "FLUENT_REPORT_FLUSH_INTERVAL", 60)
+
+
+def _serve_stale_translations():
+    """ If enabled, an invalidated language table keeps serving lookups until its
+        replacement has been loaded, rather than falling back to the datastore per string.
+    """
+    return _lookup_setting("FLUENT_SERVE_STALE_TRANSLATIONS", False)
+
+
+def _catalog_dir():
+    """ Directory holding the compiled catalogs (see fluent.catalog). If set, a language with
+        a catalog there is loaded by mapping the file and applying the changes since it was
+        compiled, rather than by querying all of its translations.
+    """
+    return getattr(settings, "FLUENT_CATALOG_DIR", None)
+
+
+def _patched_table(table, entries):
+    """ Returns a copy of `table` with `entries` added. Catalog backed tables only copy the
+        overlay of changes made since the catalog was compiled.
+    """
+    if hasattr(table, "patched"):
+        return table.patched(entries)
+
+    new_table = dict(table)
+    new_table.update(entries)
+    return new_table
+
+
+def _cache_key(text, hint):
+    """ Key used for a master text in the cache tables. Most strings don't have a hint, so
+        those are keyed on the text alone rather than allocating a tuple for each of them.
+    """
+    return (text, hint) if hint else text
+
+
+# The order in which plural forms are stored in TranslationForms
+_PLURAL_FORMS = (ZERO, ONE, TWO, FEW, MANY, OTHER)
+_PLURAL_FORM_SLOTS = {form: i for i, form in enumerate(_PLURAL_FORMS)}
+
+
+class TranslationForms(tuple):
+    """ The translated plural forms of a single string, stored positionally in the order of
+        `_PLURAL_FORMS`. Missing forms are None and trailing missing forms are dropped, so a
+        singular-only translation takes two slots.
+
+        Supports `in` and item lookups by plural form, like the `plural_texts` dict of a
+        Translation does.
+    """
+    __slots__ = ()
+
+    @classmethod
+    def from_plural_texts(cls, plural_texts, strings=None):
+        """ Build the forms from a `plural_texts` dict. If passed, `strings` is a dict used to
+            share identical strings between entries.
+        """
+        slots = [None] * len(_PLURAL_FORMS)
+        for form, text in plural_texts.iteritems():
+            slot = _PLURAL_FORM_SLOTS.get(form)
+            if slot is None:
+                # Explicit ICU values (e.g. "=0") are only used for import/export
+                continue
+            slots[slot] = text if strings is None else strings.setdefault(text, text)
+
+        while slots and slots[-1] is None:
+            slots.pop()
+        return cls(slots)
+
+    def __contains__(self, form):
+        slot = _PLURAL_FORM_SLOTS.get(form)
+        if slot is None or slot >= len(self):
+            return False
+        return tuple.__getitem__(self, slot) is not None
+
+    def __getitem__(self, form):
+        if form not in self:
+            raise KeyError(form)
+        return tuple.__getitem__(self, _PLURAL_FORM_SLOTS[form])
+
+    def get(self, form, default=None):
+        return self[form] if form in self else default
+
+    def __repr__(self):
+        return "<TranslationForms {}>".format(
+            {form: text for form, text in zip(_PLURAL_FORMS, tuple(self)) if text is not None}
+        )
+
+
+def _build_table(translations):
+    """ Returns a table of the given Translations. """
+    # Identical strings (e.g. the master text and its translation for the source
+    # language, or the same translation for different hints) are only stored once
+    strings = {}
+    table = {}
+
+    for translation in translations:
+        text = strings.setdefault(translation.denorm_master_text, translation.denorm_master_text)
+        key = _cache_key(text, translation.denorm_master_hint)
+
+        table[key] = TranslationForms.from_plural_texts(translation.plural_texts, strings)
+    return table
+
+
+def _serialize_table(table):
+    # The strings shared between entries are only pickled once
+    entries = [(key, tuple(forms)) for key, forms in table.iteritems()]
+    return zlib.compress(cPickle.dumps(entries, cPickle.HIGHEST_PROTOCOL))
+
+
+def _wait_for_snapshot(language_code, versions):
+    """ Wait for the instance which holds the lease for `versions` of the language to
+        publish its snapshot. Returns None if it doesn't appear within _LEASE_WAIT seconds.
+    """
+    deadline = time.time() + _LEASE_WAIT
+    while time.time() < deadline:
+        time.sleep(_LEASE_POLL_INTERVAL)
+        snapshot = _fetch_snapshot(language_code, versions, require_up_to_date=True)
+        if snapshot:
+            return snapshot
+
+    logger.warning("Timed out waiting for another instance to load translations for %s", language_code)
+    return None
+
+
+def _deserialize_table(data):
+    entries = cPickle.loads(zlib.decompress(data))
+    return {key: TranslationForms(forms) for key, forms in entries}
+
+
+def _publish_snapshot(language_code, table, versions, modified_since):
+    """ Store a snapshot of `table` in the cache, unless there already is one for the same
+        versions. The chunks are written first and under a new token, so that the manifest
+        never references a partially written snapshot.
+    """
+    manifest_key = _language_snapshot_key(language_code)
+    manifest = cache.get(manifest_key)
+    if manifest and manifest["versions"] == versions:
+        return
+
+    data = _serialize_table(table)
+    token = uuid.uuid4().hex
+
+    chunks = {}
+    for i, offset in enumerate(xrange(0, len(data), _SNAPSHOT_CHUNK_SIZE)):
+        chunks[_language_snapshot_chunk_key(language_code, token, i)] = data[offset:offset + _SNAPSHOT_CHUNK_SIZE]
+
+    cache.set_many(chunks, timeout=_SNAPSHOT_TIMEOUT)
+    cache.set(manifest_key, {
+        "token": token,
+        "chunks": len(chunks),
+        "versions": versions,
+        "modified_since": modified_since,
+    }, timeout=_SNAPSHOT_TIMEOUT)
+
+
+def _fetch_snapshot(language_code, versions, require_up_to_date=False):
+    """ Returns a (table, modified_since, up_to_date) tuple from the snapshot in the cache, or
+        None if there isn't a usable one for the current `versions` of the language. Unless
+        `require_up_to_date` is passed, a snapshot which predates a normal invalidation is
+        still returned so that it can be brought up to date incrementally.
+    """
+    manifest = cache.get(_language_snapshot_key(language_code))
+    if not manifest:
+        return None
+
+    snapshot_version, snapshot_full_version = manifest["versions"]
+    version, full_version = versions
+    if snapshot_full_version != full_version:
+        return None
+
+    if require_up_to_date and snapshot_version != version:
+        return None
+
+    chunk_keys = [
+        _language_snapshot_chunk_key(language_code, manifest["token"], i)
+        for i in xrange(manifest["chunks"])
+    ]
+    chunks = cache.get_many(chunk_keys)
+    if len(chunks) != len(chunk_keys):
+        # Some of the chunks have been evicted
+        return None
+
+    try:
+        table = _deserialize_table("".join(chunks[k] for k in chunk_keys))
+    except Exception:
+        logger.exception("Unable to load the snapshot of translations for %s", language_code)
+        return None
+
+    return table, manifest["modified_since"], snapshot_version == version
+
+
+class _PartialTable(object):
+    """ A table holding at most `capacity` strings of a language, evicting the least
+        recently used. Strings without a translation are kept too, as None.
+
+        Unlike full tables this is mutated by lookups, so it has a lock of its own.
+    """
+    _MISSING = object()
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self.generation = 0
+        self.hits = self.misses = self.evictions = 0
+
+    def lookup(self, key):
+        """ Returns the TranslationForms (or None) of `key`, or _MISSING if it isn't held. """
+        with self._lock:
+            forms = self._entries.pop(key, self._MISSING)
+            if forms is self._MISSING:
+                self.misses += 1
+            else:
+                # Move it to the most recently used end
+                self._entries[key] = forms
+                self.hits += 1
+            return forms
+
+    def add(self, entries, generation):
+        """ Add the fetched `entries`, unless the table has been cleared since `generation`
+            as they may be out of date.
+        """
+        with self._lock:
+            if generation != self.generation:
+                return
+
+            for key, forms in entries.iteritems():
+                self._entries.pop(key, None)
+                self._entries[key] = forms
+
+            while len(self._entries) > self.capacity:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries = OrderedDict()
+            self.generation += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "capacity": self.capacity,
+                "size": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+class _NotFetched(object):
+    """ The result of looking up a string which wasn't in memory and couldn't be fetched (see
+        _FallbackBreaker). It's falsy, like the None of a string without a translation, but
+        isn't reported as a missing translation.
+    """
+    __slots__ = ()
+
+    def __nonzero__(self):
+        return False
+
+    def __repr__(self):
+        return "_NOT_FETCHED"
+
+
+_NOT_FETCHED = _NotFetched()
+
+
+class _FallbackBreaker(object):
+    """ Limits the datastore queries made for the strings of languages which aren't loaded,
+        so that the time a page takes doesn't grow with the number of strings on it while the
+        datastore is slow. Strings which aren't fetched are returned untranslated.
+
+        Queries are allowed up to the budget of the current request and of the current second
+        (see _fallback_query_budget). A query which is slow or fails opens the breaker, and
+        no more are made until the cooldown has passed.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._request = threading.local()
+        self._second = 0
+        self._second_queries = 0
+        self.open_until = 0
+        self.allowed = self.rejected = self.trips = 0
+
+    def start_request(self):
+        self._request.queries = 0
+
+    def skipped(self):
+        """ Record that strings were left untranslated on this thread, see skipped_count. """
+        self._request.skipped = self.skipped_count() + 1
+
+    def skipped_count(self):
+        """ The number of times strings have been left untranslated on this thread, so that
+            callers can tell whether a result was degraded.
+        """
+        return getattr(self._request, "skipped", 0)
+
+    def allow(self):
+        """ Returns whether a query can be made, counting it against the budgets if so. """
+        per_request, per_second = _fallback_query_budget()
+        now = time.time()
+
+        with self._lock:
+            request_queries = getattr(self._request, "queries", 0)
+            if now < self.open_until or (per_request is not None and request_queries >= per_request):
+                self.rejected += 1
+                return False
+
+            if int(now) != self._second:
+                self._second = int(now)
+                self._second_queries = 0
+
+            if per_second is not None and self._second_queries >= per_second:
+                self.rejected += 1
+                return False
+
+            self._second_queries += 1
+            self._request.queries = request_queries + 1
+            self.allowed += 1
+            return True
+
+    def record(self, duration, failed=False):
+        """ Record how long an allowed query took, opening the breaker if it was too long. """
+        slow_query, cooldown = _fallback_slow_query()
+        if slow_query is None or not (failed or duration > slow_query):
+            return
+
+        now = time.time()
+        with self._lock:
+            if now >= self.open_until:
+                self.trips += 1
+                logger.warning(
+                    "Fallback translation query %s after %.2f seconds, skipping them for %s seconds",
+                    "failed" if failed else "completed", duration, cooldown
+                )
+            self.open_until = now + cooldown
+
+    def stats(self):
+        with self._lock:
+            return {
+                "state": "open" if time.time() < self.open_until else "closed",
+                "allowed": self.allowed,
+                "rejected": self.rejected,
+                "trips": self.trips,
+            }
+
+
+class _LoaderPool(object):
+    """ Runs loads on at most `max_workers` background threads. Loads are keyed (e.g. by
+        language code) so the same load isn't queued twice, unless it has been running for
+        longer than FLUENT_LOADER_TIMEOUT seconds in which case it's assumed to be stuck.
+
+        Threads are started as loads are queued and exit once they've been idle for a
+        while, so that nothing is left running on runtimes which don't allow it.
+    """
+
+    def __init__(self, max_workers):
+        self._max_workers = max_workers
+        self._reset()
+        self.completed = self.errors = self.timeouts = 0
+
+    def _reset(self):
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+        self._queue = Queue.Queue()
+        self._pending = {}
+        self._workers = []
+        self._pid = os.getpid()
+
+    def _check_fork(self):
+        if self._pid != os.getpid():
+            # We've been forked. The worker threads didn't come with us, so nothing would run
+            # what's pending, and one of them may have been holding the lock.
+            self._reset()
+
+    def submit(self, key, func):
+        """ Queue `func` to be run, returns False if a load for `key` is already pending. """
+        max_workers = self._max_workers() if callable(self._max_workers) else self._max_workers
+
+        self._check_fork()
+        with self._lock:
+            started = self._pending.get(key)
+            if started is not None:
+                if time.time() - started < _loader_timeout():
+                    return False
+
+                self.timeouts += 1
+                logger.warning("Loading %s has taken over %s seconds, retrying", key, _loader_timeout())
+
+            started = time.time()
+            self._pending[key] = started
+            self._queue.put((key, started, func))
+
+            if len(self._workers) < max_workers:
+                worker = threading.Thread(target=self._work, name="fluent-loader")
+                worker.daemon = True
+                self._workers.append(worker)
+                worker.start()
+        return True
+
+    def _work(self):
+        while True:
+            # If the runtime waits for the threads started by a request, don't keep it waiting
+            idle_timeout = 0 if _join_loaders_at_request_end() else _LOADER_IDLE_TIMEOUT
+            try:
+                key, started, func = self._queue.get(timeout=idle_timeout)
+            except Queue.Empty:
+                with self._lock:
+                    # Something may have been queued since we gave up waiting
+                    if self._queue.empty():
+                        self._workers.remove(threading.current_thread())
+                        return
+                    continue
+
+            try:
+                func()
+            except Exception:
+                logger.exception("Error loading translations for %s", key)
+                succeeded = False
+            else:
+                succeeded = True
+
+            with self._lock:
+                if succeeded:
+                    self.completed += 1
+                else:
+                    self.errors += 1
+
+                if self._pending.get(key) == started:
+                    del self._pending[key]
+                self._idle.notify_all()
+
+    def busy(self):
+        self._check_fork()
+        return bool(self._pending)
+
+    def join(self, timeout=None):
+        """ Wait for the pending loads to finish, for at most `timeout` seconds. """
+        deadline = None if timeout is None else time.time() + timeout
+        self._check_fork()
+        with self._lock:
+            while self._pending:
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    return
+                self._idle.wait(remaining)
+
+    def stats(self):
+        self._check_fork()
+        with self._lock:
+            return {
+                "pending": len(self._pending),
+                "workers": len(self._workers),
+                "completed": self.completed,
+                "errors": self.errors,
+                "timeouts": self.timeouts,
+            }
 
 
 class TranslationCache(object):
+    """ Per-instance cache of translations, keyed by language code.
+
+        Each language table maps `_cache_key(text, hint)` to the TranslationForms of that string.
+        It's either a dict or, for a language with a compiled catalog, a LayeredCatalog.
+        Tables are built in full by a loader and then published by swapping a
+        reference, it is never mutated afterwards. That means lookups can read
+        `self._translations` without taking any lock, `self._write_lock` is only used by the
+        code which loads, publishes or invalidates tables.
+
+        Invalidated tables are moved to `self._stale_translations`. They are used as the base
+        for an incremental reload, and are served from while the reload is in progress if
+        FLUENT_SERVE_STALE_TRANSLATIONS is set. After a full invalidation the language is in
+        `self._full_reload_pending` until a complete table has been loaded, its stale table
+        can still be served but isn't used as a base.
+
+        While a language has no table, strings which turn out to have no translation are
+        remembered in `self._untranslated` so that they aren't queried again. They are
+        forgotten when the language is invalidated or its table is loaded.
+
+        Languages in FLUENT_PARTIAL_LANGUAGES are never loaded, each has a _PartialTable in
+        `self._partial_tables` instead. These are cleared, rather than replaced, when the
+        language is invalidated so that their statistics are kept.
+
+        The last time each language was used is kept in `self._last_access`, so that idle
+        languages can be evicted by evict_idle_languages.
+
+        Tables of dialects merged with their root language (see _fallback_language) record the
+        versions of the root language they were loaded with in `self._fallback_versions`.
+
+        If FLUENT_GROUP_PARTITIONS is set, languages are loaded per translation group into
+        `self._group_tables`, keyed by (language code, group), instead. They're published and
+        invalidated in the same way as the language tables.
+    """
+
     def __init__(self):
-        self._write_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
         self._translations = {}
-        self._translation_load_times = {}
-        self._background_threads = {}
+        self._stale_translations = {}
+        self._full_reload_pending = set()
+        self._translation_versions = {}
+        self._translation_modified_since = {}
+        self._invalidation_counts = {}
+        self._untranslated = {}
+        self._catalogs = {}
+        self._partial_tables = {}
+        self._last_access = {}
+        self.evictions = 0
+        self._fallback_versions = {}
+        # Incremented whenever what a lookup could return changes, see _LazyTranslation
+        self.generation = 0
+        self._group_tables = {}
+        self._stale_group_tables = {}
+        self._group_versions = {}
+        self._group_modified_since = {}
+        self._group_invalidation_counts = {}
+        self._loader = _LoaderPool(lambda: getattr(settings, "FLUENT_LOADER_THREADS", 2))
+        # Languages whose background load is waiting for another instance's snapshot, to the
+        # versions being waited for, when to give up and when to check again
+        self._lease_waits = {}
+        self._breaker = _FallbackBreaker()
+
+    @property
+    def _write_lock(self):
+        if self._pid != os.getpid():
+            # We've been forked, possibly while a loader thread (which didn't come with us)
+            # held the lock, in which case it would never be released
+            self._pid = os.getpid()
+            self._lock = threading.Lock()
+        return self._lock
+
+    def _publish(self, language_code, table, stale=False):
+        """ Swap in a new table for `language_code`. Must be called with the write lock held.
+
+            The dicts of tables are replaced rather than updated so a reader only ever sees
+            either the old or the new mapping. Passing None for `table` invalidates the
+            language, keeping the current table around as the stale one so that it can be
+            served and refreshed incrementally. Passing `stale=True` publishes `table` as an
+            already out of date table.
+        """
+        translations = dict(self._translations)
+        stale_translations = dict(self._stale_translations)
+        if table is None:
+            stale_table = translations.pop(language_code, None)
+            if stale_table is not None:
+                stale_translations[language_code] = stale_table
+        elif stale:
+            stale_translations[language_code] = table
+        else:
+            translations[language_code] = table
+            stale_translations.pop(language_code, None)
+            self._full_reload_pending.discard(language_code)
+
+        # Either the table has the final say now, or a new translation may have been added
+        self._untranslated.pop(language_code, None)
+
+        self._stale_translations = stale_translations
+        self._translations = translations
+        self.generation += 1
+
+    def invalidate(self, language_code=None, globally=True, full=False):
+        """ Invalidate the table for `language_code`, or for all languages.
+
+            Unless `full` is passed, the next load of a single language only fetches the
+            translations which have been modified since the invalidated table was loaded. A
+            full invalidation is needed when translations have been deleted, and is always
+            done when invalidating all languages.
+        """
+        full = full or not language_code
 
-    def invalidate(self, language_code=None, globally=True):
         with self._write_lock:
-            invalidation_keys = []
-            for code in [language_code] if language_code else map(lambda x: x[0], settings.LANGUAGES):
-                invalidation_keys.append(_language_invalidation_key(code))
+            language_codes = [language_code] if language_code else map(lambda x: x[0], settings.LANGUAGES)
+
+            for code in language_codes:
+                self._invalidation_counts[code] = self._invalidation_counts.get(code, 0) + 1
+
+                partial_table = self._partial_tables.get(code)
+                if partial_table is not None:
+                    partial_table.clear()
+
+            self._invalidate_group_tables(language_codes, full)
 
-            if language_code and language_code in self._translations:
-                del self._translations[language_code]
-            elif language_code is None:
+            if language_code:
+                self._publish(language_code, None)
+            else:
+                stale_translations = dict(self._stale_translations)
+                stale_translations.update(self._translations)
+                self._stale_translations = stale_translations
                 self._translations = {}
+                self._untranslated = {}
+
+            if full:
+                # The stale tables may have translations which have since been deleted, so
+                # they can be served until the reload but mustn't be its base
+                self._full_reload_pending.update(language_codes)
 
             if globally:
-                # Set the invalidation keys in memcache to notify all instances to refresh
-                now = datetime.datetime.utcnow()
-                cache.set_many({k: now for k in invalidation_keys})
+                # Bump the versions in memcache to notify all instances to refresh
+                for code in language_codes:
+                    _bump_language_version(code, full=full)
+
+    def _invalidate_group_tables(self, language_codes, full):
+        """ Invalidate the group tables of `language_codes`. Unless `full` is passed they're
+            kept as the base for incremental reloads. Must be called with the write lock held.
+        """
+        group_tables = {}
+        stale_group_tables = dict(self._stale_group_tables)
+        for key, table in self._group_tables.iteritems():
+            if key[0] in language_codes:
+                stale_group_tables[key] = (table, self._group_modified_since.get(key))
+                self._group_versions.pop(key, None)
+            else:
+                group_tables[key] = table
+
+        if full:
+            stale_group_tables = {
+                key: value for key, value in stale_group_tables.iteritems() if key[0] not in language_codes
+            }
+
+        for code in language_codes:
+            self._group_invalidation_counts[code] = self._group_invalidation_counts.get(code, 0) + 1
+
+        self._group_tables = group_tables
+        self._stale_group_tables = stale_group_tables
+        self.generation += 1
 
     @transaction.non_atomic
-    def refetch_language(self, language_code):
-        translations = Translation.objects.filter(language_code=language_code)
+    def refetch_group(self, language_code, group):
+        """ Load the partition of `language_code` for the translations used by `group`. """
+        key = (language_code, group)
+        versions = _get_language_versions([language_code])[language_code]
+        modified_since = timezone.now()
+
+        with self._write_lock:
+            invalidation_count = self._group_invalidation_counts.get(language_code, 0)
+            base, base_modified_since = self._stale_group_tables.get(key, (None, None))
 
-        new_translations = {}
-        for translation in translations:
-            key = (translation.denorm_master_text, translation.denorm_master_hint)
+        translations = Translation.objects.filter(
+            language_code=language_code, denorm_master_groups__contains=group
+        )
+        if base is None and _is_source_language(language_code):
+            # As with a full table, only the translations which override their master text
+            translations = translations.filter(differs_from_master=True)
+
+        if base is not None and base_modified_since:
+            translations = translations.filter(
+                last_modified__gte=base_modified_since - _DELTA_REFRESH_OVERLAP
+            )
 
-            new_translations[key] = _translation_to_dict(translation)
+        entries = _build_table(translations)
+        table = entries if base is None else _patched_table(base, entries)
 
         with self._write_lock:
-            self._translations[language_code] = new_translations
-            self._translation_load_times[language_code] = datetime.datetime.utcnow()
+            if invalidation_count != self._group_invalidation_counts.get(language_code, 0):
+                # What we fetched may already be out of date, the next lookup loads it again
+                return False
 
-    def refetch_language_async(self, language_code):
-        def run(_this):
-            _this.refetch_language(language_code)
-            with _this._write_lock:
-                del _this._background_threads[language_code]
+            group_tables = dict(self._group_tables)
+            group_tables[key] = table
+            stale_group_tables = dict(self._stale_group_tables)
+            stale_group_tables.pop(key, None)
+            self._group_tables = group_tables
+            self._stale_group_tables = stale_group_tables
+            self._group_versions[key] = versions
+            self._group_modified_since[key] = modified_since
+            self.generation += 1
+        return True
+
+    @transaction.non_atomic
+    def refetch_language(self, language_code, wait_for_lease=True):
+        """ Load the table of `language_code`. If another instance holds the lease for loading
+            it in full, this waits for that instance's snapshot. Without `wait_for_lease`
+            (as used by background loads, so that a worker isn't tied up) it returns straight
+            away instead, and the load is retried by a later lookup.
+        """
+        fallback = _fallback_language(language_code)
+        if fallback:
+            return self._refetch_merged_language(language_code, fallback)
+
+        # Record the versions and time before querying, anything which changes while we're
+        # loading will be picked up by the next reload
+        versions = _get_language_versions([language_code])[language_code]
+        modified_since = timezone.now()
 
         with self._write_lock:
-            # We already got it!
-            if language_code in self._translations:
-                return self._translations[language_code]
+            invalidation_count = self._invalidation_counts.get(language_code, 0)
+            base = None
+            if language_code not in self._full_reload_pending:
+                base = self._stale_translations.get(language_code)
+            base_modified_since = self._translation_modified_since.get(language_code)
 
-            # We've already queued a thread for this, so bail
-            if language_code in self._background_threads:
-                return
+        if base is None:
+            catalog = self._mapped_catalog(language_code)
+            if catalog is not None and catalog.versions[1] is not None and catalog.versions[1] == versions[1]:
+                # Changes made since the catalog was compiled are loaded into its overlay. A
+                # full invalidation means something was deleted, which the catalog can't
+                # reflect, so it's only used while the full version still matches.
+                from fluent.catalog import LayeredCatalog
+                base, base_modified_since = LayeredCatalog(catalog), catalog.modified_since
 
-            self._background_threads[language_code] = threading.Thread(
-                target=run,
-                args=(self,)
+        if base is None and _use_shared_snapshots():
+            snapshot = _fetch_snapshot(language_code, versions)
+            if snapshot:
+                table, snapshot_modified_since, up_to_date = snapshot
+                if up_to_date:
+                    self._store(language_code, table, invalidation_count, versions, snapshot_modified_since)
+                    return
+
+                # Bring the snapshot up to date rather than loading everything
+                base, base_modified_since = table, snapshot_modified_since
+
+        if base is None and _use_shared_snapshots():
+            # Loading everything is expensive, so only one instance does it for each version
+            # and the others pick up the snapshot which it publishes. With
+            # FLUENT_SERVE_STALE_TRANSLATIONS, the table from before a full invalidation (if
+            # there is one) is served while waiting.
+            if not cache.add(_language_lease_key(language_code, versions), True, timeout=_LEASE_TIMEOUT):
+                if wait_for_lease:
+                    snapshot = _wait_for_snapshot(language_code, versions)
+                else:
+                    snapshot = _fetch_snapshot(language_code, versions, require_up_to_date=True)
+                    if not snapshot and self._wait_for_lease_later(language_code, versions):
+                        return
+
+                if snapshot:
+                    table, snapshot_modified_since, up_to_date = snapshot
+                    self._store(language_code, table, invalidation_count, versions, snapshot_modified_since)
+                    return
+
+        translations = Translation.objects.filter(language_code=language_code)
+        if base is None and _is_source_language(language_code):
+            # Only the translations which override their master text are needed. Changes
+            # are fetched in full, so an entry which no longer differs is updated too.
+            translations = translations.filter(differs_from_master=True)
+
+        if base is not None and base_modified_since:
+            # We only need the changes since the stale table was loaded. The overlap
+            # allows for the datastore indexes being eventually consistent.
+            translations = translations.filter(
+                last_modified__gte=base_modified_since - _DELTA_REFRESH_OVERLAP
             )
-            self._background_threads[language_code].start()
+
+        entries = _build_table(translations)
+        new_translations = entries if base is None else _patched_table(base, entries)
+
+        stored = self._store(language_code, new_translations, invalidation_count, versions, modified_since)
+        # Every instance has the catalog, so there's no point sharing a snapshot of it
+        if stored and _use_shared_snapshots() and not hasattr(new_translations, "patched"):
+            _publish_snapshot(language_code, new_translations, versions, modified_since)
+
+    def _refetch_merged_language(self, language_code, fallback):
+        """ Load the table of a dialect merged with the translations of its root language.
+            It depends on the changes to both, so it's always loaded in full.
+        """
+        all_versions = _get_language_versions([language_code, fallback])
+        modified_since = timezone.now()
+
+        with self._write_lock:
+            invalidation_count = self._invalidation_counts.get(language_code, 0)
+
+        table = _build_table(Translation.objects.filter(language_code=fallback))
+        table.update(_build_table(Translation.objects.filter(language_code=language_code)))
+
+        self._store(language_code, table, invalidation_count, all_versions[language_code], modified_since)
+        with self._write_lock:
+            self._fallback_versions[language_code] = all_versions[fallback]
 
     @transaction.non_atomic
+    def apply_changes(self, language_code, from_versions, to_versions):
+        """ Bring the table of `language_code` from `from_versions` up to `to_versions` by
+            patching in the translations listed in the change messages of each version in
+            between. Returns False if that isn't possible (e.g. a version was a whole
+            language invalidation, or its message has expired), in which case the language
+            needs invalidating instead.
+        """
+        from_version, full_version = from_versions
+        to_version, to_full_version = to_versions
+        if from_version is None or to_version is None or full_version != to_full_version:
+            return False
+
+        if not 0 < to_version - from_version <= _MAX_PATCHED_VERSIONS:
+            return False
+
+        # Languages which only have versions recorded (e.g. partial languages) have no table
+        # to patch, so don't fetch the changes for nothing
+        if self._translations.get(language_code) is None:
+            return False
+
+        change_keys = [
+            _language_change_key(language_code, version)
+            for version in xrange(from_version + 1, to_version + 1)
+        ]
+        changes = cache.get_many(change_keys)
+        if len(changes) != len(change_keys):
+            return False
+
+        # Fetch by key as queries may not reflect a write straight away
+        translation_ids = list({pk for pks in changes.values() for pk in pks})
+        translations = []
+        for offset in xrange(0, len(translation_ids), _MAX_KEYS_PER_GET):
+            translations.extend(Translation.objects.filter(
+                pk__in=translation_ids[offset:offset + _MAX_KEYS_PER_GET]
+            ))
+
+        return self.patch_language(language_code, translations, from_versions, to_versions)
+
+    def patch_language(self, language_code, translations, from_versions, to_versions):
+        """ Publish a copy of the table of `language_code` with the given Translations patched
+            in, if the table was loaded at `from_versions`. Returns False if there was no
+            such table.
+        """
+        strings = {}
+        with self._write_lock:
+            table = self._translations.get(language_code)
+            if table is None or self._translation_versions.get(language_code) != from_versions:
+                return False
+
+            entries = {}
+            for translation in translations:
+                key = _cache_key(translation.denorm_master_text, translation.denorm_master_hint)
+                entries[key] = TranslationForms.from_plural_texts(translation.plural_texts, strings)
+
+            self._publish(language_code, _patched_table(table, entries))
+            self._translation_versions[language_code] = to_versions
+        return True
+
+    def _mapped_catalog(self, language_code):
+        """ Returns the MappedCatalog of `language_code` if a compiled catalog exists for it,
+            remapping the file if it has been replaced since it was last mapped.
+        """
+        catalog_dir = _catalog_dir()
+        if not catalog_dir:
+            return None
+
+        from fluent.catalog import MappedCatalog, catalog_path
+        path = catalog_path(catalog_dir, language_code)
+        try:
+            mtime = os.stat(path).st_mtime
+        except OSError:
+            return None
+
+        # Loader threads can get here for the same language at once, the lock stops them
+        # each mapping the file and replacing one another's catalog
+        with self._write_lock:
+            mapped = self._catalogs.get(language_code)
+            if mapped is None or mapped[0] != mtime:
+                try:
+                    mapped = (mtime, MappedCatalog(path))
+                except (IOError, ValueError):
+                    logger.exception("Unable to map the translation catalog %s", path)
+                    return None
+                self._catalogs[language_code] = mapped
+        return mapped[1]
+
+    def _store(self, language_code, table, invalidation_count, versions, modified_since):
+        """ Publish a loaded table, returns False if it was published as stale because the
+            language was invalidated while it was being loaded.
+        """
+        with self._write_lock:
+            # If the language was invalidated while we were loading then what we fetched may
+            # already be out of date, so publish it as stale and let the next lookup refresh it
+            stale = invalidation_count != self._invalidation_counts.get(language_code, 0)
+            self._publish(language_code, table, stale=stale)
+            self._lease_waits.pop(language_code, None)
+            self._translation_versions[language_code] = versions
+            self._translation_modified_since[language_code] = modified_since
+            # A language which has just been loaded isn't idle, even if it hasn't been used
+            self._last_access.setdefault(language_code, time.time())
+        return not stale
+
+    def evict_idle_languages(self):
+        """ Drop the tables of languages which haven't been used for FLUENT_LANGUAGE_IDLE_TIMEOUT
+            seconds, and then of the least recently used languages while the tables hold more
+            than FLUENT_MAX_LOADED_STRINGS strings. Returns the evicted language codes.
+
+            Partial languages are left alone, as their size is already bounded.
+        """
+        idle_timeout = _language_idle_timeout()
+        max_strings = _max_loaded_strings()
+        if idle_timeout is None and max_strings is None:
+            return []
+
+        now = time.time()
+        with self._write_lock:
+            tables = dict(self._stale_translations)
+            tables.update(self._translations)
+            by_last_access = sorted(tables, key=lambda code: self._last_access.get(code, 0))
+
+            evicted = []
+            if idle_timeout is not None:
+                evicted = [
+                    code for code in by_last_access
+                    if now - self._last_access.get(code, 0) > idle_timeout
+                ]
+
+            if max_strings is not None:
+                size = sum(_table_size(tables[code]) for code in by_last_access if code not in evicted)
+                for code in by_last_access:
+                    if size <= max_strings:
+                        break
+                    if code not in evicted:
+                        evicted.append(code)
+                        size -= _table_size(tables[code])
+
+            if evicted:
+                self._translations = {
+                    code: table for code, table in self._translations.iteritems() if code not in evicted
+                }
+                self._stale_translations = {
+                    code: table for code, table in self._stale_translations.iteritems() if code not in evicted
+                }
+                self._full_reload_pending.difference_update(evicted)
+                self._untranslated = {
+                    code: strings for code, strings in self._untranslated.iteritems() if code not in evicted
+                }
+                for code in evicted:
+                    self._translation_versions.pop(code, None)
+                    self._translation_modified_since.pop(code, None)
+                    self._fallback_versions.pop(code, None)
+                    self._last_access.pop(code, None)
+                self.evictions += len(evicted)
+
+        if evicted:
+            logger.info("Evicted the translations of %s", ", ".join(evicted))
+        return evicted
+
+    def seed_language(self, language_code, table, modified_since):
+        """ Use `table`, which has every translation of the language modified before
+            `modified_since`, as the base for the next load of the language so that only
+            later changes are fetched. Does nothing if the language already has a table.
+        """
+        with self._write_lock:
+            if language_code in self._translations or (
+                language_code in self._stale_translations and language_code not in self._full_reload_pending
+            ):
+                return False
+
+            self._publish(language_code, table, stale=True)
+            self._full_reload_pending.discard(language_code)
+            self._translation_modified_since[language_code] = modified_since
+        return True
+
+    def _wait_for_lease_later(self, language_code, versions):
+        """ Returns True if a background load should give up for now, to check for the
+            snapshot of the instance holding the lease again after _LEASE_POLL_INTERVAL. Once
+            it has waited for _LEASE_WAIT seconds it returns False, to load the language itself.
+        """
+        now = time.time()
+        with self._write_lock:
+            wait = self._lease_waits.get(language_code)
+            deadline = wait[1] if wait is not None and wait[0] == versions else now + _LEASE_WAIT
+
+            if now >= deadline:
+                self._lease_waits.pop(language_code, None)
+                logger.warning(
+                    "Timed out waiting for another instance to load translations for %s", language_code
+                )
+                return False
+
+            self._lease_waits[language_code] = (versions, deadline, now + _LEASE_POLL_INTERVAL)
+            return True
+
+    def refetch_language_async(self, language_code):
+        def run():
+            # Another load may have published the table while this one was queued
+            if language_code not in self._translations:
+                self.refetch_language(language_code, wait_for_lease=False)
+
+        # We already got it! This is the hot path, so no locking here
+        translations = self._translations.get(language_code)
+        if translations is not None:
+            return translations
+
+        wait = self._lease_waits.get(language_code)
+        if wait is not None and time.time() < wait[2]:
+            # Waiting for another instance, it's too soon to check for its snapshot again
+            return None
+
+        # This does nothing if a load of the language is already pending
+        self._loader.submit(language_code, run)
+
     def fetch_translation(self, text, hint, language_code):
-        return Translation.objects.filter(
-            master_text_hint_hash=Translation.generate_hash(text, hint),
-            language_code=language_code
-        ).first()
+        """ Returns the TranslationForms of a single string, or None if it isn't translated
+            (or couldn't be fetched).
+        """
+        return self.fetch_translations([(text, hint)], language_code).get((text, hint))
+
+    @transaction.non_atomic
+    def fetch_translations(self, strings, language_code):
+        """ Fetch the translations of the given (text, hint) pairs without loading the whole
+            language. Returns a dict of the pairs to their TranslationForms, or to None if
+            there's no translation.
+
+            If FLUENT_STRING_CACHE is set then the cache is checked first with a single
+            get_many, and whatever is fetched from the datastore is written back to it.
+
+            Pairs which weren't fetched because the fallback breaker is open, its budget has
+            been used up or the query failed are left out of the result.
+        """
+        hashes = {Translation.generate_hash(text, hint): (text, hint) for text, hint in strings}
+        results = {}
+
+        string_cache = _use_string_cache()
+        if string_cache:
+            version_key = _language_version_key(language_code)
+            string_keys = {_language_string_key(language_code, h): h for h in hashes}
+
+            cached = cache.get_many(string_keys.keys() + [version_key])
+            version = cached.get(version_key)
+            for string_key, master_hash in string_keys.iteritems():
+                if string_key not in cached:
+                    continue
+
+                # Anything cached at a different version of the language may be out of date
+                cached_version, forms = cached[string_key]
+                if cached_version != version:
+                    continue
+
+                results[hashes[master_hash]] = TranslationForms(forms) if forms else None
+
+        missing = [h for h in hashes if hashes[h] not in results]
+        fetched = {}
+        queried = []
+        for offset in xrange(0, len(missing), _MAX_HASHES_PER_QUERY):
+            if not self._breaker.allow():
+                break
+
+            chunk = missing[offset:offset + _MAX_HASHES_PER_QUERY]
+            started = time.time()
+            try:
+                translations = list(Translation.objects.filter(
+                    master_text_hint_hash__in=chunk,
+                    language_code=language_code
+                ))
+            except Exception:
+                # Degrade to the untranslated text rather than failing the page
+                logger.exception("Error fetching translations of %s", language_code)
+                self._breaker.record(time.time() - started, failed=True)
+                break
+            self._breaker.record(time.time() - started)
+
+            for translation in translations:
+                fetched[translation.master_text_hint_hash] = TranslationForms.from_plural_texts(
+                    translation.plural_texts
+                )
+            queried.extend(chunk)
+
+        if len(queried) != len(missing):
+            self._breaker.skipped()
+        missing = queried
+
+        for master_hash in missing:
+            results[hashes[master_hash]] = fetched.get(master_hash)
+
+        if string_cache and missing:
+            # Untranslated strings are cached too, as an empty tuple
+            cache.set_many({
+                _language_string_key(language_code, h): (version, tuple(fetched.get(h, ())))
+                for h in missing
+            }, timeout=_STRING_CACHE_TIMEOUT)
+
+        return results
+
+    def _partial_table(self, language_code, capacity):
+        partial_table = self._partial_tables.get(language_code)
+        if partial_table is None:
+            # Record the versions before anything is fetched, so that the invalidation
+            # checks clear the table if anything changes after this
+            versions = _get_language_versions([language_code])[language_code]
+            with self._write_lock:
+                partial_table = self._partial_tables.get(language_code)
+                if partial_table is None:
+                    partial_tables = dict(self._partial_tables)
+                    partial_table = partial_tables[language_code] = _PartialTable(capacity)
+                    self._partial_tables = partial_tables
+                    self._translation_versions.setdefault(language_code, versions)
+        return partial_table
+
+    def get_partial_translations(self, strings, language_code, capacity):
+        """ Look up the given (text, hint) pairs in the partial table of `language_code`,
+            fetching all those which it doesn't hold with a single fetch_translations.
+            Returns a dict of the pairs to their TranslationForms, None or _NOT_FETCHED.
+        """
+        partial_table = self._partial_table(language_code, capacity)
+        generation = partial_table.generation
+
+        results = {}
+        missing = []
+        for text, hint in strings:
+            forms = partial_table.lookup(_cache_key(text, hint))
+            if forms is _PartialTable._MISSING:
+                missing.append((text, hint))
+            else:
+                results[(text, hint)] = forms
+
+        if missing:
+            fetched = self.fetch_translations(missing, language_code)
+            partial_table.add(
+                {_cache_key(text, hint): forms for (text, hint), forms in fetched.iteritems()}, generation
+            )
+            for pair in missing:
+                results[pair] = fetched.get(pair, _NOT_FETCHED)
+        return results
+
+    def get_translations(self, strings, language_code, group=None):
+        """ Batch version of get_translation. Returns a dict of the given (text, hint) pairs to
+            their TranslationForms (or None, or _NOT_FETCHED), fetching all those which aren't
+            in the cache with a single fetch_translations.
+        """
+        self._last_access[language_code] = time.time()
+        strings = set(strings)
+
+        capacity = _partial_capacity(language_code)
+        if capacity:
+            return self.get_partial_translations(strings, language_code, capacity)
+
+        results = {}
+        if _use_group_partitions():
+            group = group or _active_group()
+            key = (language_code, group)
+            table = self._group_tables.get(key)
+            if table is None:
+                self._loader.submit(key, partial(self.refetch_group, language_code, group))
+                if _is_source_language(language_code):
+                    return dict.fromkeys(strings)
+                table = {}
+
+            missing = []
+            for text, hint in strings:
+                forms = table.get(_cache_key(text, hint))
+                if forms is None:
+                    missing.append((text, hint))
+                else:
+                    results[(text, hint)] = forms
+
+            if missing:
+                results.update(self.get_partial_translations(missing, language_code, _group_miss_capacity()))
+            return results
+
+        translations = self.refetch_language_async(language_code)
+        if translations is None and _serve_stale_translations():
+            translations = self._stale_translations.get(language_code)
+
+        if translations is not None:
+            return {(text, hint): translations.get(_cache_key(text, hint)) for text, hint in strings}
+
+        if _is_source_language(language_code):
+            return dict.fromkeys(strings)
+
+        untranslated = self._untranslated_strings(language_code)
+        missing = []
+        for text, hint in strings:
+            if _cache_key(text, hint) in untranslated:
+                results[(text, hint)] = None
+            else:
+                missing.append((text, hint))
+
+        if missing:
+            fetched = self.fetch_translations(missing, language_code)
+            for pair in missing:
+                results[pair] = fetched.get(pair, _NOT_FETCHED)
+            for (text, hint), forms in fetched.iteritems():
+                if not forms and len(untranslated) < _UNTRANSLATED_LIMIT:
+                    untranslated.add(_cache_key(text, hint))
+        return results
+
+    def get_group_translation(self, text, hint, language_code, group):
+        key = (language_code, group)
+        table = self._group_tables.get(key)
+        if table is None:
+            # This does nothing if a load of the partition is already pending
+            self._loader.submit(key, partial(self.refetch_group, language_code, group))
+            if _is_source_language(language_code):
+                return None
+        else:
+            forms = table.get(_cache_key(text, hint))
+            if forms is not None:
+                return forms
+
+        # The string isn't in the partition (or it hasn't been loaded yet), so look it up on
+        # its own. The partition only holds what the scanner found, so this isn't cached as
+        # untranslated.
+        return self.get_partial_translations(
+            [(text, hint)], language_code, _group_miss_capacity()
+        )[(text, hint)]
+
+    def get_translation(self, text, hint, language_code, group=None):
+        """ Returns the TranslationForms of a string, None if it has no translation or
+            _NOT_FETCHED if it wasn't in memory and couldn't be fetched.
+        """
+        self._last_access[language_code] = time.time()
+
+        capacity = _partial_capacity(language_code)
+        if capacity:
+            return self.get_partial_translations([(text, hint)], language_code, capacity)[(text, hint)]
+
+        if _use_group_partitions():
+            return self.get_group_translation(text, hint, language_code, group or _active_group())
 
-    def get_translation(self, text, hint, language_code):
         # This will trigger off a thread if necessary. If there are valid
         # translations available already for a language they will be returned.
         translations = self.refetch_language_async(language_code)
 
-        if not translations:
-            translation = self.fetch_translation(text, hint, language_code)
-            if translation:
-                return _translation_to_dict(translation)
-        else:
-            return self._translations[language_code].get(
-                (text, hint)
+        if translations is None and _serve_stale_translations():
+            # Keep serving the previous table until the reload has been swapped in
+            translations = self._stale_translations.get(language_code)
+
+        if translations is None and _is_source_language(language_code):
+            # Most strings of the source language are their own translation, so rather than
+            # fetching each of them while the overrides load the master text is used
+            return None
+
+        if translations is None:
+            key = _cache_key(text, hint)
+            untranslated = self._untranslated_strings(language_code)
+            if key in untranslated:
+                return None
+
+            translation = self.fetch_translations([(text, hint)], language_code).get(
+                (text, hint), _NOT_FETCHED
             )
 
+            # If the language was invalidated during the fetch then this set has been
+            # replaced, so a result which may be out of date is dropped along with it
+            if translation is None and len(untranslated) < _UNTRANSLATED_LIMIT:
+                untranslated.add(key)
+            return translation
+        else:
+            return translations.get(_cache_key(text, hint))
+
+    def _untranslated_strings(self, language_code):
+        untranslated = self._untranslated.get(language_code)
+        if untranslated is None:
+            with self._write_lock:
+                untranslated = self._untranslated.setdefault(language_code, set())
+        return untranslated
+
 
 # Global variable so that we only need to fetch stuff once per
 # instance
@@ -110,46 +1571,501 @@ TRANSLATION_CACHE = TranslationCache()
 
 
 def ensure_threads_join(sender, **kwargs):
-    """ Makes sure any background threads complete. Is
-        connected to the request_finished signal.
+    """ Makes sure any background loads complete if FLUENT_JOIN_LOADERS_AT_REQUEST_END is
+        set, for runtimes which don't allow threads to outlive a request. Is connected to
+        the request_finished signal.
+    """
+    if _join_loaders_at_request_end():
+        TRANSLATION_CACHE._loader.join()
 
-        Also invalidates any languages that have been marked as invalid in memcache
+
+def check_for_invalidations():
+    """
+        Does a single memcache RPC to compare the versions of the loaded languages with the
+        versions they were loaded at, and regenerates any which have been invalidated since.
+
+        This doesn't depend on a request, so it can be called from deferred tasks or
+        background threads.
     """
-    for language_code in TRANSLATION_CACHE._background_threads.keys():
-        thread = TRANSLATION_CACHE._background_threads[language_code]
-        if thread.is_alive():
-            thread.join()
+    global _last_invalidation_check
+    _last_invalidation_check = time.time()
+
+    TRANSLATION_CACHE.evict_idle_languages()
+
+    loaded_versions = dict(TRANSLATION_CACHE._translation_versions)
+    group_versions = dict(TRANSLATION_CACHE._group_versions)
+    fallback_versions = dict(TRANSLATION_CACHE._fallback_versions)
+    fallbacks = {code: _fallback_language(code) for code in fallback_versions}
+    language_codes = (
+        set(loaded_versions) | {code for code, group in group_versions} | set(filter(None, fallbacks.values()))
+    )
+    if not language_codes:
+        return
+
+    current_versions = _get_language_versions(language_codes)
+    for language_code, fallback_version in fallback_versions.iteritems():
+        # A merged dialect table is reloaded when its root language changes
+        fallback = fallbacks[language_code]
+        if fallback and current_versions[fallback] != fallback_version:
+            had_table = language_code in TRANSLATION_CACHE._translations
+            TRANSLATION_CACHE.invalidate(language_code, globally=False, full=True)
+            with TRANSLATION_CACHE._write_lock:
+                TRANSLATION_CACHE._fallback_versions.pop(language_code, None)
+            if had_table:
+                TRANSLATION_CACHE.refetch_language_async(language_code)
+
+    for language_code, versions in current_versions.items():
+        # Group tables aren't patched, only reloaded
+        outdated_groups = [
+            loaded for (code, group), loaded in group_versions.iteritems()
+            if code == language_code and loaded != versions
+        ]
+        if outdated_groups:
+            with TRANSLATION_CACHE._write_lock:
+                TRANSLATION_CACHE._invalidate_group_tables(
+                    [language_code], full=any(loaded[1] != versions[1] for loaded in outdated_groups)
+                )
+
+        if language_code not in loaded_versions:
+            continue
+
+        loaded_version, loaded_full_version = loaded_versions[language_code]
+        version, full_version = versions
+        if version == loaded_version:
+            continue
+
+        # Individual edits can be patched in without reloading the language
+        if TRANSLATION_CACHE.apply_changes(language_code, loaded_versions[language_code], versions):
+            continue
+
+        had_table = language_code in TRANSLATION_CACHE._translations
+        TRANSLATION_CACHE.invalidate(
+            language_code, globally=False, full=(full_version != loaded_full_version)
+        )
+        with TRANSLATION_CACHE._write_lock:
+            # Don't invalidate again for the same version. The reload records the
+            # versions which it actually loaded.
+            TRANSLATION_CACHE._translation_versions[language_code] = versions
+
+        # Start a background thread to regenerate. Languages which weren't loaded in full
+        # (e.g. partial languages) refill as they're used.
+        if had_table:
+            TRANSLATION_CACHE.refetch_language_async(language_code)
+
+
+_last_invalidation_check = 0
 
 
 def invalidate_caches_if_necessary(sender, **kwargs):
     """
-        Fires at the start of a request, does a single memcache RPC to see if the
-        translation caches need invalidating and regenerating
+        Fires at the start of a request, and checks whether the translation caches need
+        invalidating and regenerating if that hasn't been done in the last
+        FLUENT_INVALIDATION_CHECK_INTERVAL seconds.
     """
+    if time.time() - _last_invalidation_check >= _invalidation_check_interval():
+        check_for_invalidations()
 
-    # Check for any necessary invalidations
-    keys = { _language_invalidation_key(x): x for x in map(lambda x: x[0], settings.LANGUAGES) }
-    for k, v in cache.get_many(keys.keys()).items():
-        # If the time invalidated is greater than the time we loaded, then
-        # invalidate the cache for this language
-        language_code = keys[k]
-        load_time_per_language_code = TRANSLATION_CACHE._translation_load_times.get(language_code)
-        if (v and load_time_per_language_code) and v > load_time_per_language_code:
-            TRANSLATION_CACHE.invalidate(language_code, globally=False)
 
-            # Start a background thread to regenerate
-            TRANSLATION_CACHE.refetch_language_async(language_code)
+_poller_lock = threading.Lock()
+_poller_thread = None
+
+
+def _poll_for_invalidations():
+    while True:
+        time.sleep(_invalidation_check_interval())
+        try:
+            check_for_invalidations()
+        except Exception:
+            logger.exception("Error checking for invalidated translations")
+
+
+def start_invalidation_poller():
+    """ Start a daemon thread which checks for invalidations every
+        FLUENT_INVALIDATION_CHECK_INTERVAL seconds, for runtimes which allow threads to
+        outlive requests.
+    """
+    global _poller_thread
+    with _poller_lock:
+        if _poller_thread and _poller_thread.is_alive():
+            return
+
+        _poller_thread = threading.Thread(target=_poll_for_invalidations, name="fluent-invalidation-poller")
+        _poller_thread.daemon = True
+        _poller_thread.start()
 
 
 def translations_loading():
-    return bool(TRANSLATION_CACHE._background_threads)
+    return TRANSLATION_CACHE._loader.busy()
+
+
+def loader_stats():
+    """ Returns counts of the pending, completed, failed and timed out background loads. """
+    return TRANSLATION_CACHE._loader.stats()
+
+
+def fallback_breaker_stats():
+    """ Returns the state ("open" or "closed") of the breaker limiting the datastore queries
+        for the strings of languages which aren't loaded, and the number of queries it has
+        allowed and rejected and the number of times it has opened.
+    """
+    return TRANSLATION_CACHE._breaker.stats()
+
+
+def reset_fallback_budget(sender, **kwargs):
+    """ Fires at the start of a request, and resets its budget of fallback queries. """
+    TRANSLATION_CACHE._breaker.start_request()
+
+
+def partial_table_stats():
+    """ Returns a dict of the capacity, size, hits, misses and evictions of the table of
+        each language in FLUENT_PARTIAL_LANGUAGES which has been used. With
+        FLUENT_GROUP_PARTITIONS, it also has the tables of strings which weren't in the
+        partition of the group they were looked up in, per language.
+    """
+    return {
+        language_code: partial_table.stats()
+        for language_code, partial_table in TRANSLATION_CACHE._partial_tables.items()
+    }
+
+
+def language_stats():
+    """ Returns the number of strings in and seconds since the last use of each loaded
+        language, and the number of languages which have been evicted.
+    """
+    now = time.time()
+    tables = dict(TRANSLATION_CACHE._stale_translations)
+    tables.update(TRANSLATION_CACHE._translations)
+    return {
+        "loaded": {
+            code: {
+                "size": _table_size(table),
+                "idle": now - TRANSLATION_CACHE._last_access.get(code, now),
+            }
+            for code, table in tables.iteritems()
+        },
+        "evictions": TRANSLATION_CACHE.evictions,
+    }
+
+
+def prewarm_translations(language_codes=None, workers=4):
+    """ Load the tables of `language_codes` (defaults to all of settings.LANGUAGES), using at
+        most `workers` threads, and block until they have all been loaded.
+
+        Does nothing with FLUENT_GROUP_PARTITIONS, as full tables wouldn't be used.
+    """
+    if _use_group_partitions():
+        return
+
+    if language_codes is None:
+        language_codes = [code for code, name in settings.LANGUAGES]
+
+    pool = _LoaderPool(workers)
+    for language_code in language_codes:
+        if language_code not in TRANSLATION_CACHE._translations and not _partial_capacity(language_code):
+            pool.submit(language_code, partial(TRANSLATION_CACHE.refetch_language, language_code))
+    pool.join()
+
+
+@transaction.non_atomic
+def write_translation_snapshot(path, language_codes=None):
+    """ Write the tables of `language_codes` (defaults to all of settings.LANGUAGES) to a file
+        at `path`, to be shipped with a deployment and loaded with load_translation_snapshot.
+    """
+    if language_codes is None:
+        language_codes = [code for code, name in settings.LANGUAGES]
+
+    languages = {}
+    for language_code in language_codes:
+        # The snapshot can only be used while the full version is unchanged, so it needs one
+        _ensure_full_version(language_code)
+
+        versions = _get_language_versions([language_code])[language_code]
+        modified_since = timezone.now()
+        table = _build_table(Translation.objects.filter(language_code=language_code))
+        languages[language_code] = (versions, modified_since, _serialize_table(table))
 
+    temp_path = "{}.{}.tmp".format(path, os.getpid())
+    with open(temp_path, "wb") as f:
+        cPickle.dump({"languages": languages}, f, cPickle.HIGHEST_PROTOCOL)
+    os.rename(temp_path, path)
 
-def invalidate_language(language_code):
-    TRANSLATION_CACHE.invalidate(language_code)
 
+def load_translation_snapshot(path, workers=4):
+    """ Load the tables written by write_translation_snapshot, and bring them up to date by
+        fetching the translations modified since it was written. Returns the codes of the
+        languages which were loaded.
 
-def _get_trans(text, hint, count=1, language_override=None):
+        A language is skipped if it has had a full invalidation since the snapshot was
+        written (or if the snapshot was written using a different cache), as that means a
+        translation may have been deleted. Nothing is loaded with FLUENT_GROUP_PARTITIONS.
+    """
+    if _use_group_partitions():
+        return []
+
+    try:
+        with open(path, "rb") as f:
+            snapshot = cPickle.load(f)
+    except (IOError, EOFError, cPickle.UnpicklingError):
+        logger.exception("Unable to load the translation snapshot %s", path)
+        return []
+
+    languages = snapshot["languages"]
+    current_versions = _get_language_versions(languages.keys())
+
+    seeded = []
+    for language_code, (versions, modified_since, data) in languages.iteritems():
+        full_version = versions[1]
+        if full_version is None or full_version != current_versions[language_code][1]:
+            continue
+
+        if TRANSLATION_CACHE.seed_language(language_code, _deserialize_table(data), modified_since):
+            seeded.append(language_code)
+
+    prewarm_translations(seeded, workers)
+    return seeded
+
+
+def invalidate_language(language_code, full=False):
+    TRANSLATION_CACHE.invalidate(language_code, full=full)
+
+
+def invalidate_translation(translation):
+    """ Invalidate a single Translation which has been created or edited. It's patched into
+        the table of this instance straight away, and a change message is left for the new
+        version of the language so that other instances can patch it in too.
+    """
+    language_code = translation.language_code
+    loaded_versions = TRANSLATION_CACHE._translation_versions.get(language_code)
+
+    version = _bump_language_version(language_code)
+    cache.set(_language_change_key(language_code, version), [translation.pk], timeout=_CHANGE_TIMEOUT)
+
+    if loaded_versions:
+        full_version = loaded_versions[1]
+        TRANSLATION_CACHE.patch_language(
+            language_code, [translation], (version - 1, full_version), (version, full_version)
+        )
+
+
+def invalidate_deleted_translation(sender, instance, **kwargs):
+    """ Connected to the post_delete signal of Translation. Incremental reloads can't see
+        deleted translations, so the language has to be reloaded in full.
+    """
+    TRANSLATION_CACHE.invalidate(instance.language_code, full=True)
+
+
+class _HitCounter(object):
+    """ Counts hits per key in memory, so that they can be written out in a single batch
+        rather than as they happen. At most `limit` distinct keys are held between flushes,
+        hits of any others are only counted in `dropped`.
+    """
+
+    def __init__(self, limit):
+        self.limit = limit
+        self._lock = threading.Lock()
+        self._counts = {}
+        self.last_flush = time.time()
+        self.dropped = 0
+
+    def hit(self, key, count=1):
+        with self._lock:
+            if key in self._counts:
+                self._counts[key] += count
+            elif len(self._counts) < self.limit:
+                self._counts[key] = count
+            else:
+                self.dropped += count
+
+    def take(self):
+        """ Returns the counts since the last call, and starts counting afresh. """
+        with self._lock:
+            counts, self._counts = self._counts, {}
+            self.last_flush = time.time()
+        return counts
+
+
+_missing_translations = _HitCounter(_MISSING_REPORT_LIMIT)
+_string_usage = _HitCounter(_USAGE_REPORT_LIMIT)
+
+
+def _add_counts(model, rows, flush_id=None):
+    """ Add the counts in `rows`, a dict of primary key to (fields of a new row, count), to
+        the `count` of the rows of `model` (MissingTranslation or StringUsage). Run as a
+        deferred task.
+
+        Each row records the `flush_id` of the counts last added to it, so the rows which
+        were already written aren't counted twice if the task is retried.
+    """
+    now = timezone.now()
+    keys = rows.keys()
+    for i in xrange(0, len(keys), _REPORT_ROWS_PER_TRANSACTION):
+        batch = keys[i:i + _REPORT_ROWS_PER_TRANSACTION]
+        with transaction.atomic(xg=True):
+            existing = model.objects.in_bulk(batch)
+            for key in batch:
+                fields, count = rows[key]
+                row = existing.get(key)
+                if row is None:
+                    row = model(pk=key, first_seen=now, **fields)
+                elif flush_id and row.last_flush == flush_id:
+                    continue
+                row.count += count
+                row.last_seen = now
+                row.last_flush = flush_id or ""
+                row.save()
+
+
+def _queue_counts(counter, model, rows):
+    """ Queue _add_counts tasks for `rows`, a list of (key in `counter`, primary key, fields
+        of a new row, count), split so that no task is too large. The counts of a task which
+        can't be queued are put back into `counter` for the next flush.
+    """
+    def queue(chunk):
+        try:
+            defer(_add_counts, model, {
+                pk: (fields, count) for counter_key, pk, fields, count in chunk
+            }, uuid.uuid4().hex)
+        except Exception:
+            logger.exception("Unable to queue the counts of %s rows", model.__name__)
+            for counter_key, pk, fields, count in chunk:
+                counter.hit(counter_key, count)
+
+    chunk = []
+    size = 0
+    for row in rows:
+        chunk.append(row)
+        size += sum(len(value) for value in row[2].itervalues())
+        if len(chunk) >= _REPORT_ROWS_PER_TASK or size >= _REPORT_TASK_SIZE:
+            queue(chunk)
+            chunk = []
+            size = 0
+    if chunk:
+        queue(chunk)
+
+
+def flush_missing_translations():
+    """ Queue tasks writing the missing translations counted since the last flush. """
+    counts = _missing_translations.take()
+    _queue_counts(_missing_translations, MissingTranslation, [
+        (
+            (text, hint, language_code),
+            MissingTranslation.generate_key(text, hint, language_code),
+            {"text": text, "hint": hint, "language_code": language_code},
+            count,
+        )
+        for (text, hint, language_code), count in counts.iteritems()
+    ])
+
+
+def flush_string_usage():
+    """ Queue tasks writing the sampled lookups counted since the last flush. """
+    counts = _string_usage.take()
+    _queue_counts(_string_usage, StringUsage, [
+        ((text, hint), Translation.generate_hash(text, hint), {"text": text, "hint": hint}, count)
+        for (text, hint), count in counts.iteritems()
+    ])
+
+
+def hot_strings(limit=1000):
+    """ Returns the (text, hint) of the `limit` most used strings according to the StringUsage
+        report, e.g. for warming the tables of FLUENT_PARTIAL_LANGUAGES with get_translations.
+    """
+    return [(usage.text, usage.hint) for usage in StringUsage.objects.order_by("-count")[:limit]]
+
+
+def flush_reports_if_necessary(sender, **kwargs):
+    """ Fires at the end of a request, and flushes the counts collected in memory if that
+        hasn't been done in the last FLUENT_REPORT_FLUSH_INTERVAL seconds.
+    """
+    now = time.time()
+    if now - _missing_translations.last_flush >= _report_flush_interval():
+        flush_missing_translations()
+    if now - _string_usage.last_flush >= _report_flush_interval():
+        flush_string_usage()
+
+
+def _sample_usage(text, hint):
+    """ Count a lookup of `text` towards the StringUsage report, if it's picked by the
+        FLUENT_USAGE_SAMPLE_RATE sampling. Each sampled lookup stands for 1 / rate of them.
+    """
+    sample_rate = _usage_sample_rate()
+    if sample_rate and random.random() < sample_rate:
+        _string_usage.hit((force_text(text), force_text(hint or u"")), int(round(1.0 / sample_rate)))
+
+
+class _LanguageResolver(object):
+    """ What _get_trans needs to know about a language, worked out once per language rather
+        than on every lookup.
+    """
+    __slots__ = ("language_code", "plural_index", "singular_index", "singular_slot", "is_source")
+
+    def __init__(self, language_code):
+        self.language_code = language_code
+        self.plural_index = get_rules_for_language(language_code)
+        self.singular_index = self.plural_index(1)
+        self.singular_slot = _PLURAL_FORM_SLOTS.get(self.singular_index)
+        self.is_source = _is_source_language(language_code)
+
+    def select(self, text, hint, forms, count, plural=None):
+        """ Returns the form of `forms` (the translation of `text`) to use for `count`. """
+        if not forms:
+            if self.is_source:
+                # The master text is its own translation, this is what the table would have held
+                if plural is not None and self.plural_index(count) != self.singular_index:
+                    return unicode(plural)
+                return unicode(text)
+
+            # We have no translation for this text.
+            if _report_missing_translations() and forms is not _NOT_FETCHED:
+                _missing_translations.hit((force_text(text), force_text(hint or u""), self.language_code))
+
+            # This unicode() call is important.  If we are here it means that we do not have a
+            # translation for this text string, so we want to just return the default text, which is
+            # the `text` variable. But if this variable has come from a `{% trans %}` tag, then it will
+            # have been through django.template.base.Variable.__init__, which makes the assumption that
+            # any string literal defined in a template is safe, and therefore it calls mark_safe() on
+            # it.  Fluent's `trans` tag deliberately does NOT make the assumption that string literals
+            # defined inside it are safe (because we don't want to send pre-escaped text to translators)
+            # and therefore we must remove the assumption that the string is safe. Calling unicode() on
+            # it turns it from a SafeText object back to a normal unicode object.
+            return unicode(text)
+
+        plural_index = self.singular_index if count == 1 else self.plural_index(count)
+
+        if type(forms) is TranslationForms:
+            # Read the slot directly rather than going through the mapping interface
+            slot = _PLURAL_FORM_SLOTS[plural_index]
+            if slot < len(forms):
+                form = tuple.__getitem__(forms, slot)
+                if form is not None:
+                    return form
+        elif plural_index in forms:
+            return forms[plural_index]
+
+        # Fall back to singular form if the correct plural doesn't exist. This will happen until all languages have been re-uploaded.
+        return forms[self.singular_index]
+
+
+_resolvers = {}
+
+
+def _get_resolver(language_code):
+    try:
+        return _resolvers[language_code]
+    except KeyError:
+        resolver = _resolvers[language_code] = _LanguageResolver(language_code)
+        return resolver
+
+
+def _clear_resolvers(sender, setting, **kwargs):
+    if setting in ("LANGUAGE_CODE", "FLUENT_SOURCE_LANGUAGE_FAST_PATH"):
+        _resolvers.clear()
+
+
+setting_changed.connect(_clear_resolvers, dispatch_uid="fluent.clear_resolvers")
+
+
+def _get_trans(text, hint, count=1, language_override=None, group=None, plural=None):
     from django.utils.translation import get_language
 
     language_code = language_override or get_language()
@@ -165,66 +2081,225 @@ def _get_trans(text, hint, count=1, language_override=None):
     if not text:
         return u""
 
-    forms = TRANSLATION_CACHE.get_translation(text, hint, language_code)
+    _sample_usage(text, hint)
 
-    if not forms:
-        # We have no translation for this text.
-        logger.debug(
-            "Found string not translated into %s so falling back to default, string was %s",
-            language_code, text
-        )
-        # This unicode() call is important.  If we are here it means that we do not have a
-        # translation for this text string, so we want to just return the default text, which is
-        # the `text` variable. But if this variable has come from a `{% trans %}` tag, then it will
-        # have been through django.template.base.Variable.__init__, which makes the assumption that
-        # any string literal defined in a template is safe, and therefore it calls mark_safe() on
-        # it.  Fluent's `trans` tag deliberately does NOT make the assumption that string literals
-        # defined inside it are safe (because we don't want to send pre-escaped text to translators)
-        # and therefore we must remove the assumption that the string is safe. Calling unicode() on
-        # it turns it from a SafeText object back to a normal unicode object.
-        return unicode(text)
+    forms = TRANSLATION_CACHE.get_translation(text, hint, language_code, group)
+    return _get_resolver(language_code).select(text, hint, forms, count, plural)
+
+
+def gettext_many(items, language_code=None, group=None):
+    """ Translate a list of (text, hint, count) or (text, hint, count, plural) items into
+        `language_code` (defaults to the active language), returning the translations in the
+        same order. Any strings which aren't in the cache are fetched together, rather than
+        one at a time.
+    """
+    from django.utils.translation import get_language
+
+    items = [tuple(item) if len(item) == 4 else tuple(item) + (None,) for item in items]
+
+    language_code = language_code or get_language()
+    if language_code is None:
+        return [unicode(text) for text, hint, count, plural in items]
 
-    plural_index = get_plural_index(language_code, count)
-    # Fall back to singular form if the correct plural doesn't exist. This will happen until all languages have been re-uploaded.
-    if plural_index in forms:
-        return forms[plural_index]
+    strings = [(text, hint) for text, hint, count, plural in items if text]
+    for text, hint in strings:
+        _sample_usage(text, hint)
 
-    singular_index = get_plural_index(language_code, 1)
-    return forms[singular_index]
+    translations = TRANSLATION_CACHE.get_translations(strings, language_code, group)
+    resolver = _get_resolver(language_code)
+    return [
+        resolver.select(text, hint, translations[(text, hint)], count, plural) if text else u""
+        for text, hint, count, plural in items
+    ]
 
 
 def gettext(message, group=None):
-    return _get_trans(message, hint="").encode("utf-8")
+    return _get_trans(message, hint="", group=group).encode("utf-8")
 
 
 def ugettext(message, group=None):
     from django.utils.encoding import force_unicode
-    return force_unicode(_get_trans(message, hint="", count=1))
+    return force_unicode(_get_trans(message, hint="", count=1, group=group))
 
 
 def pgettext(context, message, group=None):
-    return _get_trans(message, hint=context)
+    return _get_trans(message, hint=context, group=group)
 
 
 def ungettext(singular, plural, number, group=None):
     from django.utils.encoding import force_unicode
-    return force_unicode(_get_trans(singular, hint="", count=number))
+    return force_unicode(_get_trans(singular, hint="", count=number, group=group, plural=plural))
 
 
 def ngettext(singular, plural, number, group=None):
-    return _get_trans(singular, hint="", count=number).encode("utf-8")
+    return _get_trans(singular, hint="", count=number, group=group, plural=plural).encode("utf-8")
 
 
 def npgettext(context, singular, plural, number, group=None):
-    return _get_trans(singular, context, number)
+    return _get_trans(singular, context, number, group=group, plural=plural)
+
+
+from django.utils.functional import Promise
+
+
+class _LazyTranslation(Promise):
+    """ Lazily translated string, used instead of django.utils.functional.lazy.
+
+        The translation is remembered along with the active language and the generation of
+        the translation cache it was resolved with, so a string defined at import time (e.g.
+        a form label) is only translated again if either has changed.
+
+        Subclasses set `_delegate_text` or `_delegate_bytes`, which Django checks on
+        Promises, depending on whether the function returns unicode or a bytestring.
+    """
+
+    def __init__(self, func, *args, **kwargs):
+        self._func = func
+        self._args = args
+        self._kwargs = kwargs
+        self._memo = None
+
+    def _resolve(self):
+        from django.utils.translation import get_language
+
+        key = (get_language(), TRANSLATION_CACHE.generation)
+        memo = self._memo
+        if memo is None or memo[0] != key:
+            skipped = TRANSLATION_CACHE._breaker.skipped_count()
+            value = self._func(*self._args, **self._kwargs)
+            if TRANSLATION_CACHE._breaker.skipped_count() != skipped:
+                # The translation couldn't be fetched, so don't keep the untranslated text
+                return value
+
+            # A single assignment, so another thread never sees a key with the wrong value
+            memo = self._memo = (key, value)
+        return memo[1]
+
+    # Used by Django (e.g. Field.get_prep_value) to resolve Promises
+    _proxy____cast = _resolve
+
+    def __getattr__(self, name):
+        # Anything else (e.g. format(), upper()) is looked up on the translated string
+        return getattr(self._resolve(), name)
+
+    def __reduce__(self):
+        return (_unpickle_lazy_translation, (type(self), self._func, self._args, self._kwargs))
+
+    def __deepcopy__(self, memo):
+        # Instances are effectively immutable, so there's no need to copy them
+        memo[id(self)] = self
+        return self
+
+    def __repr__(self):
+        return repr(self._resolve())
+
+    def __eq__(self, other):
+        if isinstance(other, Promise):
+            other = other._proxy____cast()
+        return self._resolve() == other
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __lt__(self, other):
+        if isinstance(other, Promise):
+            other = other._proxy____cast()
+        return self._resolve() < other
+
+    def __le__(self, other):
+        if isinstance(other, Promise):
+            other = other._proxy____cast()
+        return self._resolve() <= other
+
+    def __gt__(self, other):
+        if isinstance(other, Promise):
+            other = other._proxy____cast()
+        return self._resolve() > other
+
+    def __ge__(self, other):
+        if isinstance(other, Promise):
+            other = other._proxy____cast()
+        return self._resolve() >= other
+
+    def __hash__(self):
+        return hash(self._resolve())
+
+    def __mod__(self, rhs):
+        return self._resolve() % rhs
+
+    def __rmod__(self, lhs):
+        return lhs % self._resolve()
+
+    def __mul__(self, count):
+        return self._resolve() * count
+
+    def __rmul__(self, count):
+        return count * self._resolve()
+
+    def __add__(self, other):
+        return self._resolve() + other
+
+    def __radd__(self, other):
+        return other + self._resolve()
+
+    def __len__(self):
+        return len(self._resolve())
+
+    def __contains__(self, item):
+        return item in self._resolve()
+
+    def __getitem__(self, key):
+        return self._resolve()[key]
+
+    def __iter__(self):
+        return iter(self._resolve())
+
+
+class _LazyText(_LazyTranslation):
+    _delegate_text = True
+    _delegate_bytes = False
+
+    def __unicode__(self):
+        return self._resolve()
+
+    def __str__(self):
+        return self._resolve().encode("utf-8")
+
+
+class _LazyBytes(_LazyTranslation):
+    _delegate_text = False
+    _delegate_bytes = True
+
+    def __str__(self):
+        return self._resolve()
+
+    def __unicode__(self):
+        return self._resolve().decode("utf-8")
+
+
+def _unpickle_lazy_translation(lazy_class, func, args, kwargs):
+    return lazy_class(func, *args, **kwargs)
+
+
+def gettext_lazy(message, group=None):
+    return _LazyBytes(gettext, message, group=group)
+
+
+def ugettext_lazy(message, group=None):
+    return _LazyText(ugettext, message, group=group)
+
+
+def pgettext_lazy(context, message, group=None):
+    return _LazyText(pgettext, context, message, group=group)
+
+
+def ngettext_lazy(singular, plural, number, group=None):
+    return _LazyBytes(ngettext, singular, plural, number, group=group)
 
 
-from django.utils.functional import lazy
+def ungettext_lazy(singular, plural, number, group=None):
+    return _LazyText(ungettext, singular, plural, number, group=group)
 
 
-gettext_lazy = lazy(gettext, str)
-ugettext_lazy = lazy(ugettext, unicode)
-pgettext_lazy = lazy(pgettext, unicode)
-ngettext_lazy = lazy(ngettext, str)
-ungettext_lazy = lazy(ungettext, unicode)
-npgettext_lazy = lazy(npgettext, unicode)
+def npgettext_lazy(context, singular, plural, number, group=None):
+    return _LazyText(npgettext, context, singular, plural, number, group=group)
@@ -1,24 +1,66 @@
 from django.conf import settings
 
 
+# The LANGUAGES setting which _closest_languages and _fallback_chains were built from
+_resolved_languages = None
+_closest_languages = {}
+_fallback_chains = {}
+
+
+def _resolve_languages():
+    """ Build the lookups of the closest supported language and of the fallback chain of
+        each supported language. They're rebuilt if the LANGUAGES setting is replaced (e.g. by
+        override_settings).
+    """
+    global _resolved_languages, _closest_languages, _fallback_chains
+
+    languages = settings.LANGUAGES
+    if languages is _resolved_languages:
+        return
+
+    supported = [code for code, name in languages]
+
+    closest = {code: code for code in supported}
+    for code in supported:
+        # A root language matches itself if it's supported, otherwise its first dialect
+        root_language = code.split("-")[0]
+        if root_language not in closest:
+            closest[root_language] = code
+
+    fallback_chains = {}
+    for code in supported:
+        root_language = code.split("-")[0]
+        if root_language != code and root_language in supported:
+            fallback_chains[code] = (code, root_language)
+        else:
+            fallback_chains[code] = (code,)
+
+    _closest_languages, _fallback_chains = closest, fallback_chains
+    _resolved_languages = languages
+
+
 def find_closest_supported_language(language_code):
-    lookup = dict(settings.LANGUAGES).keys()
+    _resolve_languages()
 
-    # If it's in there, return this supported language
-    if language_code in lookup:
-        return language_code
+    # If it's in there (or it's the root of a supported dialect), return the supported language
+    try:
+        return _closest_languages[language_code]
+    except KeyError:
+        pass
 
-    # If this is a dialect, then see if the root language is there
+    # If this is a dialect, then see if the root language (or another dialect of it) is there
     root_language = language_code.split("-")[0]
-    if root_language in lookup:
-        return root_language
-
     try:
-        # Finally, if there is another dialect with the same root language
-        # then return that, otherwise raise an error
-        check = "{}-".format(root_language)
-        return (x for x in lookup if x.startswith(check)).next()
-    except StopIteration:
+        return _closest_languages[root_language]
+    except KeyError:
         raise ValueError(
             "Unable to find a suitable match for language_code: {}".format(language_code)
         )
+
+
+def language_fallback_chain(language_code):
+    """ Returns the supported languages to look for a translation in, in order, e.g.
+        ("pt-br", "pt") if both are supported. The master text is the final fallback.
+    """
+    _resolve_languages()
+    return _fallback_chains.get(language_code, (language_code,))